@@ -0,0 +1,184 @@
+"""
+Local OpenAI-compatible chat-completions endpoint for offline benchmarks.
+
+Answers POST /v1/chat/completions after a configurable latency, fails a
+configurable share of requests with 500 and rate-limits another share with
+429 + Retry-After. Responses are valid mitigation JSON for the requirement
+IDs found in the prompt (single-threat and multi-threat formats), with a
+`usage` block, and are deterministic for a given prompt. Cascade screening
+prompts get a {"relevant": [...]} answer. Requests with "stream": true get
+the same answer as SSE deltas.
+
+Point the tool at it with LLM_API_URL=http://127.0.0.1:<port>/v1/chat/completions.
+
+Usage:
+    python benchmarks/mock_llm_server.py --port 8765 --latency 0.2 --error-rate 0.01 --rate-limit-rate 0.05
+"""
+import re
+import json
+import time
+import random
+import zlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REQUIREMENT_ID = re.compile(r"^- ID: '?([^'\n]+?)'?$", re.MULTILINE)
+THREAT_ID = re.compile(r"^(?:- |  )ID: '?([^'\n]+?)'?$", re.MULTILINE)
+
+class MockLLMSettings:
+    def __init__(self, latency=0.05, jitter=0.02, error_rate=0.0, rate_limit_rate=0.0,
+                 retry_after=0.1, match_rate=0.3, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.match_rate = match_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+
+    def roll(self) -> tuple:
+        with self.lock:
+            self.requests += 1
+            return self.rng.random(), max(0.0, self.rng.gauss(self.latency, self.jitter))
+
+def _mitigates(threat_key: str, requirement_id: str, match_rate: float) -> bool:
+    # Deterministic per (threat, requirement) so repeated runs give the same answers
+    return zlib.crc32(f"{threat_key}\x00{requirement_id}".encode("utf-8")) % 1000 < match_rate * 1000
+
+def build_answer(user_prompt: str, match_rate: float, screen=False) -> str:
+    head, _, candidates = user_prompt.partition("CandidateRequirements:")
+    requirement_ids = REQUIREMENT_ID.findall(candidates)
+    if screen:
+        # Cascade screen: keeps a superset of what the full prompt would match (twice the match rate)
+        return json.dumps({"relevant": [rid for rid in requirement_ids
+                                        if _mitigates(head, rid, min(1.0, 2 * match_rate))]})
+    if head.startswith("Threats:"):
+        threat_ids = THREAT_ID.findall(head)
+        return json.dumps({"threats": {
+            threat_id: [
+                {"requirement": rid, "justification": f"{rid} mitigates threat {threat_id}."}
+                for rid in requirement_ids if _mitigates(threat_id, rid, match_rate)
+            ]
+            for threat_id in threat_ids
+        }})
+    return json.dumps({"mitigations": [
+        {"requirement": rid, "justification": f"{rid} mitigates this threat."}
+        for rid in requirement_ids if _mitigates(head, rid, match_rate)
+    ]})
+
+def make_handler(settings: MockLLMSettings):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status: int, body: dict, headers=None):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            try:
+                self.wfile.write(data)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # the client gave up on the request (e.g. a hedged duplicate that lost)
+
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            roll, latency = settings.roll()
+            time.sleep(latency)
+
+            if roll < settings.rate_limit_rate:
+                with settings.lock:
+                    settings.rate_limited += 1
+                self._send(429, {"error": {"message": "Rate limit reached"}},
+                           {"Retry-After": str(settings.retry_after)})
+                return
+            if roll < settings.rate_limit_rate + settings.error_rate:
+                with settings.lock:
+                    settings.errors += 1
+                self._send(500, {"error": {"message": "Internal server error"}})
+                return
+
+            messages = payload.get("messages", [])
+            user_prompt = messages[-1]["content"] if messages else ""
+            system_prompt = messages[0]["content"] if len(messages) > 1 else ""
+            answer = build_answer(user_prompt, settings.match_rate, screen='"relevant"' in system_prompt)
+            prompt_chars = sum(len(m.get("content", "")) for m in messages)
+            usage = {"prompt_tokens": prompt_chars // 4, "completion_tokens": len(answer) // 4,
+                     "total_tokens": prompt_chars // 4 + len(answer) // 4}
+            if payload.get("stream"):
+                self._send_stream(answer, usage if (payload.get("stream_options") or {}).get("include_usage") else None)
+                return
+            self._send(200, {
+                "id": f"mock-{settings.requests}",
+                "object": "chat.completion",
+                "model": payload.get("model", "mock"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": answer},
+                             "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+        def _send_stream(self, answer: str, usage=None, piece=16):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            try:
+                for i in range(0, len(answer), piece):
+                    event = {"choices": [{"index": 0, "delta": {"content": answer[i:i + piece]}}]}
+                    self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+                if usage:
+                    self.wfile.write(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n".encode("utf-8"))
+                self.wfile.write(b"data: [DONE]\n\n")
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # the client cut the stream off
+
+    return Handler
+
+def start_mock_server(host="127.0.0.1", port=0, **settings) -> tuple:
+    """
+    Start the mock server in a daemon thread. Returns (server, url, settings);
+    call server.shutdown() to stop it.
+    """
+    mock_settings = MockLLMSettings(**settings)
+    server = ThreadingHTTPServer((host, port), make_handler(mock_settings))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://{host}:{server.server_address[1]}/v1/chat/completions"
+    return server, url, mock_settings
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a mock OpenAI-compatible chat-completions server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.05, help="mean response time in seconds")
+    parser.add_argument("--jitter", type=float, default=0.02, help="standard deviation of the response time")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of requests answered with 429")
+    parser.add_argument("--retry-after", type=float, default=0.1, help="Retry-After sent with 429s (seconds)")
+    parser.add_argument("--match-rate", type=float, default=0.3, help="share of candidates reported as mitigating")
+    args = parser.parse_args()
+
+    server, url, _ = start_mock_server(
+        args.host, args.port, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate, retry_after=args.retry_after, match_rate=args.match_rate
+    )
+    print(f"🧪 Mock LLM listening on {url} (Ctrl-C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
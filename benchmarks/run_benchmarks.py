@@ -0,0 +1,278 @@
+"""
+Offline end-to-end benchmarks on synthetic data against the mock LLM.
+
+Scenarios:
+- load:       parse the threat / requirement workbooks, cold and from the Parquet sidecar
+- filtering:  asset extraction + asset-index filtering for every threat
+- end_to_end: stream_threats against the local mock endpoint; throughput,
+              p50/p99 request latency, peak memory, retries and per-stage times
+- startup:    cold import time of the entry points (see startup_benchmark.py)
+
+Nothing leaves the machine: the LLM is benchmarks/mock_llm_server.py on
+127.0.0.1, the response cache and workbook sidecars go to a temporary
+directory, token counts use the heuristic tokenizer (no tokenizer
+downloads) and semantic filters (which need embedding models) stay off.
+Each result is appended to benchmarks/results/benchmarks.jsonl with the git
+revision, and compared with the previous run of the same scenario/parameters.
+
+Usage:
+    python benchmarks/run_benchmarks.py --sizes 100,1000 --requirements 2000 \\
+        --latency 0.05 --error-rate 0.01 --rate-limit-rate 0.02
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import shutil
+import resource
+import tempfile
+import statistics
+import subprocess
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+RESULTS_FILE = os.path.join(BENCH_DIR, "results", "benchmarks.jsonl")
+DATA_DIR = os.path.join(BENCH_DIR, "data")
+
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+# Everything the tool persists goes to a scratch directory, so runs don't see each other's caches;
+# token counts are estimated so --pack-tokens doesn't download tiktoken / Hugging Face tokenizer files
+SCRATCH_DIR = tempfile.mkdtemp(prefix="threatmapper-bench-")
+os.environ.update({
+    "LLM_PROVIDER": "openai",
+    "OPENAI_API_KEY": "mock",
+    "LLM_TOKENIZER": "heuristic",
+    "HF_HUB_OFFLINE": "1",
+    "LLM_CACHE_PATH": os.path.join(SCRATCH_DIR, "llm_cache.sqlite"),
+    "WORKBOOK_CACHE_DIR": os.path.join(SCRATCH_DIR, "workbooks"),
+    "EMBEDDING_CACHE_DIR": os.path.join(SCRATCH_DIR, "embeddings"),
+})
+
+from synthetic_data import ASSETS, write_workbooks
+from mock_llm_server import start_mock_server
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def bench_load(threat_path, requirement_path, **_):
+    from data_loader import read_threats, read_requirements
+
+    timings = {}
+    for label in ("cold", "warm"):  # the first read writes the Parquet sidecar, the second uses it
+        start = time.perf_counter()
+        read_threats(threat_path)
+        read_requirements(requirement_path)
+        timings[f"{label}_s"] = round(time.perf_counter() - start, 4)
+    return timings
+
+def bench_filtering(threat_path, requirement_path, **_):
+    from data_loader import read_threats, read_requirements
+    from llm_threat_mapper import AssetMatcher, filter_requirements_by_assets, AssetIndex
+
+    threats = [row.to_dict() for _, row in read_threats(threat_path).iterrows()]
+    requirements = read_requirements(requirement_path)
+
+    start = time.perf_counter()
+    index = AssetIndex(requirements)
+    matcher = AssetMatcher(ASSETS)  # a fresh one, so the per-interaction memo starts cold
+    index_s = time.perf_counter() - start
+    candidates = 0
+    for threat in threats:
+        assets = matcher.extract(threat["Interaction"])
+        candidates += len(filter_requirements_by_assets(requirements, assets, index))
+    elapsed = time.perf_counter() - start
+    return {
+        "index_build_s": round(index_s, 4),
+        "total_s": round(elapsed, 4),
+        "threats_per_s": round(len(threats) / elapsed, 1),
+        "avg_candidates": round(candidates / max(len(threats), 1), 1),
+    }
+
+def bench_end_to_end(threat_path, requirement_path, mock, concurrency=None, chunk_size=5,
+                     pack_tokens=False, threat_batch_size=1, cascade=False, **_):
+    import threat_processor
+    from data_loader import read_threats, read_requirements
+    from metrics import get_metrics
+
+    threats_df = read_threats(threat_path)
+    requirements = read_requirements(requirement_path)
+
+    # Client-side latency of every HTTP request (retries count as separate requests)
+    latencies = []
+
+    async def on_request(request):
+        request.extensions["bench_start"] = time.perf_counter()
+
+    async def on_response(response):
+        latencies.append(time.perf_counter() - response.request.extensions["bench_start"])
+
+    make_client = threat_processor.make_async_client
+
+    def timed_client(config, max_connections=None):
+        client = make_client(config, max_connections=max_connections)
+        client.event_hooks = {"request": [on_request], "response": [on_response]}
+        return client
+
+    threat_processor.make_async_client = timed_client
+    get_metrics().reset()
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        rows = 0
+        for _ in threat_processor.stream_threats(
+            threats_df, requirements, "", "benchmark context", "benchmark hint",
+            asset_list=ASSETS, use_cache=False, concurrency=concurrency, chunk_size=chunk_size,
+            pack_tokens=pack_tokens, threat_batch_size=threat_batch_size, cascade=cascade
+        ):
+            rows += 1
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        threat_processor.make_async_client = make_client
+
+    report = get_metrics().report()
+    return {
+        "threats": rows,
+        "total_s": round(elapsed, 3),
+        "threats_per_s": round(rows / elapsed, 2),
+        "http_requests": len(latencies),
+        "requests_per_s": round(len(latencies) / elapsed, 2),
+        "latency_p50_s": round(percentile(latencies, 0.50), 4),
+        "latency_p99_s": round(percentile(latencies, 0.99), 4),
+        "mock_429s": mock.rate_limited,
+        "mock_500s": mock.errors,
+        "llm_retries": report["events"].get("llm_retries", 0),
+        "llm_errors": report["events"].get("llm_errors", 0),
+        "parse_failures": report["events"].get("parse_failures", 0),
+        "tracemalloc_peak_mb": round(peak / 1e6, 1),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "stages_s": {stage: round(entry["seconds"], 4) for stage, entry in report["stages"].items()},
+    }
+
+def bench_startup(repeat=3, **_):
+    from startup_benchmark import TARGETS, time_import
+
+    results = {}
+    for target, statement in TARGETS.items():
+        try:
+            results[f"{target}_s"] = round(statistics.median(time_import(statement) for _ in range(repeat)), 4)
+        except subprocess.CalledProcessError:
+            results[f"{target}_s"] = None  # e.g. streamlit not installed
+    return results
+
+SCENARIOS = {
+    "load": bench_load,
+    "filtering": bench_filtering,
+    "end_to_end": bench_end_to_end,
+    "startup": bench_startup,
+}
+
+def previous_result(scenario: str, params: dict):
+    if not os.path.exists(RESULTS_FILE):
+        return None
+    previous = None
+    with open(RESULTS_FILE, "r", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if record["scenario"] == scenario and record["params"] == params:
+                previous = record
+    return previous
+
+def print_result(record: dict, previous: dict):
+    print(f"⏱️ {record['scenario']} {record['params']}")
+    for name, value in record["results"].items():
+        line = f"    {name:<22} {value}"
+        old = (previous or {}).get("results", {}).get(name)
+        if isinstance(value, (int, float)) and isinstance(old, (int, float)) and old:
+            line += f"   (prev {old}, {(value - old) / old:+.0%})"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks on synthetic workbooks with a mock LLM.")
+    parser.add_argument("--scenarios", default="load,filtering,end_to_end,startup")
+    parser.add_argument("--sizes", default="100,1000", help="comma-separated threat counts (up to 100k)")
+    parser.add_argument("--requirements", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--chunk-size", type=int, default=5)
+    parser.add_argument("--pack-tokens", action="store_true")
+    parser.add_argument("--threat-batch-size", type=int, default=1)
+    parser.add_argument("--cascade", action="store_true", help="screen candidates before the justification prompt")
+    parser.add_argument("--repeat", type=int, default=3, help="repetitions for the startup scenario")
+    args = parser.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    server, url, mock = start_mock_server(
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate, seed=args.seed
+    )
+    os.environ["LLM_API_URL"] = url
+    os.environ.setdefault("LLM_BACKOFF_BASE", "0.05")  # keep retry waits short against the mock
+    os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+
+    revision = git_revision()
+    try:
+        for scenario in scenarios:
+            sizes = [None] if scenario == "startup" else [int(s) for s in args.sizes.split(",")]
+            for size in sizes:
+                params = {"repeat": args.repeat} if scenario == "startup" else {
+                    "threats": size, "requirements": args.requirements, "seed": args.seed}
+                if scenario == "end_to_end":
+                    params.update(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                                  rate_limit_rate=args.rate_limit_rate, concurrency=args.concurrency,
+                                  chunk_size=args.chunk_size, pack_tokens=args.pack_tokens,
+                                  threat_batch_size=args.threat_batch_size, cascade=args.cascade)
+
+                paths = {}
+                if size is not None:
+                    paths = dict(zip(("threat_path", "requirement_path"),
+                                     write_workbooks(DATA_DIR, size, args.requirements, args.seed)))
+                mock.rate_limited = mock.errors = 0
+                results = SCENARIOS[scenario](
+                    **paths, mock=mock, concurrency=args.concurrency, chunk_size=args.chunk_size,
+                    pack_tokens=args.pack_tokens, threat_batch_size=args.threat_batch_size, cascade=args.cascade,
+                    repeat=args.repeat
+                )
+
+                record = {
+                    "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "revision": revision,
+                    "python": sys.version.split()[0],
+                    "scenario": scenario,
+                    "params": params,
+                    "results": results,
+                }
+                print_result(record, previous_result(scenario, params))
+                with open(RESULTS_FILE, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record) + "\n")
+    finally:
+        server.shutdown()
+        shutil.rmtree(SCRATCH_DIR, ignore_errors=True)
+
+    print(f"✅ Results appended to: {RESULTS_FILE}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Cold-start benchmark for the CLI and the Streamlit app.
+
+Each target is imported in a fresh interpreter (so nothing is warm) and the
+wall time is recorded, together with the slowest imports reported by
+`python -X importtime`. Results are appended to benchmarks/results/startup.jsonl
+so runs before and after a change can be compared.
+
+Usage:
+    python benchmarks/startup_benchmark.py [--repeat 5]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_FILE = os.path.join(REPO_ROOT, "benchmarks", "results", "startup.jsonl")
+
+# What each entry point imports before it can do any work
+TARGETS = {
+    "main.py": "import main, data_loader, threat_processor, result_writer, system_summary, file_paths",
+    "streamlit_app.py": "import streamlit_app",
+}
+
+def time_import(statement: str) -> float:
+    code = f"import time; t = time.perf_counter(); {statement}; print(time.perf_counter() - t)"
+    result = subprocess.run(
+        [sys.executable, "-c", code], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+def slowest_imports(statement: str, top: int = 5) -> list:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement], cwd=REPO_ROOT, capture_output=True, text=True
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        # "import time:  self [us] | cumulative | imported package"
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative_us), name.strip()))
+    rows.sort(reverse=True)
+    return [{"module": name, "cumulative_ms": round(us / 1000, 1)} for us, name in rows[:top]]
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold-start import time of the entry points.")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+    for target, statement in TARGETS.items():
+        try:
+            timings = [time_import(statement) for _ in range(args.repeat)]
+        except subprocess.CalledProcessError as e:
+            print(f"❌ {target}: import failed\n{e.stderr}")
+            continue
+
+        record = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "target": target,
+            "python": sys.version.split()[0],
+            "repeat": args.repeat,
+            "median_s": round(statistics.median(timings), 4),
+            "min_s": round(min(timings), 4),
+            "max_s": round(max(timings), 4),
+            "slowest_imports": slowest_imports(statement),
+        }
+        print(f"⏱️ {target}: median {record['median_s']}s (min {record['min_s']}s, max {record['max_s']}s)")
+        for entry in record["slowest_imports"]:
+            print(f"    {entry['cumulative_ms']:>9} ms  {entry['module']}")
+
+        with open(RESULTS_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+
+    print(f"✅ Results appended to: {RESULTS_FILE}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Synthetic threat and requirement workbooks for benchmarking.
+
+Rows follow the layout of the real exports: threats have
+"AssetA to AssetB: description" interactions and STRIDE categories,
+requirements have [AVP_PCyA_nnnn] IDs and comma-separated "Assets Allocated
+to" lists (including alias spellings such as "SwitchStack" or "Hypervisor"
+that the asset index has to resolve). Generation is seeded, so the same
+arguments always produce the same workbooks.
+
+Usage:
+    python benchmarks/synthetic_data.py --threats 1000 --requirements 2000 --out benchmarks/data
+"""
+import os
+import random
+import argparse
+import pandas as pd
+
+ASSETS = [
+    "vCenter Server", "vCenter", "Switch", "Firewall", "NTP", "OS ESXi", "Harvester",
+    "Exported CSP", "OS Linux", "OS Windows", "Workstation", "Exported Projects",
+    "BR Solution", "AVP Application Suite",
+]
+
+# Spellings seen in requirement baselines that differ from the threat model's asset names
+ASSET_VARIANTS = {
+    "Switch": ["SwitchStack", "switch"],
+    "OS ESXi": ["ESXi", "Hypervisor"],
+    "vCenter": ["VCenter"],
+    "BR Solution": ["Backup"],
+}
+
+CATEGORIES = [
+    "Spoofing", "Tampering", "Repudiation", "Information Disclosure",
+    "Denial Of Service", "Elevation Of Privilege",
+]
+
+FLOWS = ["HTTPS", "SSH", "SNMP", "NTP sync", "REST API", "Syslog", "LDAP bind", "Backup job", "vMotion"]
+
+THREAT_TEMPLATES = [
+    "An adversary may spoof {src} and send forged {flow} traffic to {dst}.",
+    "{flow} data exchanged between {src} and {dst} may be tampered with in transit.",
+    "{dst} may not log {flow} requests from {src}, so actions cannot be attributed.",
+    "Credentials used by {src} for {flow} may be disclosed to an attacker on the network.",
+    "{dst} may be flooded with {flow} requests from {src}, making it unavailable.",
+    "A low-privileged user on {src} may abuse {flow} to gain administrative rights on {dst}.",
+]
+
+REQUIREMENT_TEMPLATES = [
+    "The {asset} shall authenticate all {flow} peers using mutually verified certificates.",
+    "The {asset} shall protect the integrity of {flow} traffic with an approved MAC or signature.",
+    "The {asset} shall record security-relevant {flow} events in a tamper-evident audit log.",
+    "The {asset} shall encrypt {flow} traffic using TLS 1.2 or higher.",
+    "The {asset} shall rate-limit incoming {flow} requests and drop malformed packets.",
+    "The {asset} shall enforce role-based access control for all {flow} operations.",
+    "The {asset} shall disable unused {flow} services by default.",
+    "The {asset} shall synchronise its clock with an authenticated time source.",
+]
+
+def generate_threats(count: int, seed: int = 0) -> pd.DataFrame:
+    rng = random.Random(seed)
+    rows = []
+    for i in range(count):
+        src, dst = rng.sample(ASSETS, 2)
+        flow = rng.choice(FLOWS)
+        category_index = rng.randrange(len(CATEGORIES))
+        rows.append({
+            "Id": i + 1,
+            "Title": f"{CATEGORIES[category_index]} of {flow} between {src} and {dst}",
+            "Category": CATEGORIES[category_index],
+            "Interaction": f"{src} to {dst}: {flow}",
+            "Description": THREAT_TEMPLATES[category_index].format(src=src, dst=dst, flow=flow),
+        })
+    return pd.DataFrame(rows)
+
+def _allocated_asset(rng) -> str:
+    asset = rng.choice(ASSETS)
+    if asset in ASSET_VARIANTS and rng.random() < 0.3:
+        return rng.choice(ASSET_VARIANTS[asset])
+    return asset
+
+def generate_requirements(count: int, seed: int = 0) -> pd.DataFrame:
+    rng = random.Random(seed + 1)
+    rows = []
+    for i in range(count):
+        assets = sorted({_allocated_asset(rng) for _ in range(rng.choice([1, 1, 2, 3]))})
+        rows.append({
+            "Requirement ID": f"[AVP_PCyA_{1000 + i}]",
+            "Description": rng.choice(REQUIREMENT_TEMPLATES).format(asset=assets[0], flow=rng.choice(FLOWS)),
+            "Assets Allocated to": ", ".join(assets),
+        })
+    return pd.DataFrame(rows)
+
+def write_workbooks(directory: str, threats: int, requirements: int, seed: int = 0) -> tuple:
+    """
+    Write threats_<n>.xlsx and requirements_<n>.xlsx into `directory` (reusing
+    existing files for the same sizes and seed) and return their paths.
+    """
+    os.makedirs(directory, exist_ok=True)
+    threat_path = os.path.join(directory, f"threats_{threats}_s{seed}.xlsx")
+    requirement_path = os.path.join(directory, f"requirements_{requirements}_s{seed}.xlsx")
+    if not os.path.exists(threat_path):
+        generate_threats(threats, seed).to_excel(threat_path, index=False)
+    if not os.path.exists(requirement_path):
+        generate_requirements(requirements, seed).to_excel(requirement_path, index=False)
+    return threat_path, requirement_path
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic threat / requirement workbooks.")
+    parser.add_argument("--threats", type=int, default=1000)
+    parser.add_argument("--requirements", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+    args = parser.parse_args()
+
+    threat_path, requirement_path = write_workbooks(args.out, args.threats, args.requirements, args.seed)
+    print(f"✅ Threats: {threat_path}\n✅ Requirements: {requirement_path}")
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,76 @@
+import io
+import os
+import hashlib
+import tempfile
 import pandas as pd
 
-def read_threats(file_path: str) -> pd.DataFrame:
-    """Loads the threats Excel file."""
-    return pd.read_excel(file_path)
+WORKBOOK_CACHE_DIR = os.getenv("WORKBOOK_CACHE_DIR", ".cache/workbooks")
 
-def read_requirements(file_path: str) -> list[dict]:
+# Excel column -> requirement dict key
+REQUIREMENT_COLUMNS = {
+    "Requirement ID": "id",
+    "Description": "text",
+    "Assets Allocated to": "assets",
+}
+THREAT_COLUMNS = ["Id", "Title", "Category", "Interaction", "Description"]
+
+def _read_bytes(source) -> bytes:
+    """Raw workbook bytes from a path, bytes, or a file-like object (e.g. a Streamlit upload)."""
+    if isinstance(source, (bytes, bytearray)):
+        return bytes(source)
+    if hasattr(source, "getvalue"):
+        return source.getvalue()
+    if hasattr(source, "read"):
+        source.seek(0)
+        return source.read()
+    with open(source, "rb") as f:
+        return f.read()
+
+def _sidecar_path(data: bytes, kind: str, columns) -> str:
+    digest = hashlib.sha256(data)
+    digest.update(repr(columns).encode("utf-8"))
+    return os.path.join(WORKBOOK_CACHE_DIR, f"{kind}_{digest.hexdigest()[:32]}.parquet")
+
+def load_workbook(source, kind: str, columns=None) -> pd.DataFrame:
+    """
+    Read the first sheet of a workbook (only `columns`, if given).
+
+    Parsed sheets are kept as Parquet sidecar files keyed by the workbook's
+    content hash, so loading an unchanged workbook again skips Excel parsing.
+    Caching is skipped when pyarrow isn't installed or the sheet can't be
+    stored as Parquet.
+    """
+    data = _read_bytes(source)
+    sidecar = _sidecar_path(data, kind, columns)
+    if os.path.exists(sidecar):
+        try:
+            return pd.read_parquet(sidecar)
+        except Exception:
+            pass
+
+    df = pd.read_excel(io.BytesIO(data), usecols=columns, engine="openpyxl")
+    tmp = None
+    try:
+        os.makedirs(WORKBOOK_CACHE_DIR, exist_ok=True)
+        # A temp file of our own: parallel shard workers may cache the same workbook at once
+        fd, tmp = tempfile.mkstemp(dir=WORKBOOK_CACHE_DIR, suffix=".tmp")
+        os.close(fd)
+        df.to_parquet(tmp, index=False)
+        os.replace(tmp, sidecar)
+    except Exception:
+        if tmp is not None and os.path.exists(tmp):
+            os.remove(tmp)
+    return df
+
+def read_columns(source) -> list:
+    """Column names of a workbook's first sheet (reads the header row only)."""
+    return list(pd.read_excel(io.BytesIO(_read_bytes(source)), nrows=0, engine="openpyxl").columns)
+
+def read_threats(file_path, columns=None) -> pd.DataFrame:
+    """Loads the threats Excel file (all columns unless `columns` is given)."""
+    return load_workbook(file_path, "threats", columns)
+
+def read_requirements(file_path) -> list[dict]:
     """Loads the requirements Excel file and converts them to a list of dictionaries."""
-    df = pd.read_excel(file_path)
-    requirements = []
-    for _, row in df.iterrows():
-        requirements.append({
-            "id": row["Requirement ID"],
-            "text": row["Description"],
-            "assets": row["Assets Allocated to"]
-        })
-    return requirements
+    df = load_workbook(file_path, "requirements", list(REQUIREMENT_COLUMNS))
+    return df[list(REQUIREMENT_COLUMNS)].rename(columns=REQUIREMENT_COLUMNS).to_dict("records")
@@ -0,0 +1,99 @@
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+from model_registry import get_embedding_model, DEFAULT_EMBEDDING_MODEL
+
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", ".cache/embeddings")
+EMBEDDING_DTYPE = os.getenv("EMBEDDING_DTYPE", "float32")  # "float16" halves the file size
+
+def requirement_embedding_text(req: dict) -> str:
+    """Text that gets embedded for a requirement (description enriched with its assets)."""
+    return f"{req['text']} Asset: {req['assets']}"
+
+def _content_hash(req: dict) -> str:
+    return hashlib.sha256(f"{req['id']}\x00{requirement_embedding_text(req)}".encode("utf-8")).hexdigest()
+
+class EmbeddingStore:
+    """
+    On-disk store of normalized requirement embeddings: a memory-mapped
+    .npy matrix plus a JSON index of (id, content hash) per row.
+
+    sync() returns a matrix aligned with the given requirements, re-encoding
+    only requirements that are new or whose text/assets changed and dropping
+    rows of requirements that no longer exist.
+    """
+
+    def __init__(self, model_name=DEFAULT_EMBEDDING_MODEL, directory=EMBEDDING_CACHE_DIR, dtype=EMBEDDING_DTYPE):
+        self.model_name = model_name
+        self.dtype = np.dtype(dtype)
+        self.directory = os.path.join(directory, model_name.replace("/", "__"))
+        self.matrix_path = os.path.join(self.directory, "embeddings.npy")
+        self.index_path = os.path.join(self.directory, "index.json")
+        self.fingerprint = None  # hash of the requirement set from the last sync()
+
+    def _load(self):
+        if not (os.path.exists(self.matrix_path) and os.path.exists(self.index_path)):
+            return None, []
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        if index.get("dtype") != self.dtype.name:
+            return None, []
+        return np.load(self.matrix_path, mmap_mode="r"), index["hashes"]
+
+    def _save(self, matrix, ids, hashes):
+        os.makedirs(self.directory, exist_ok=True)
+        # Temp files of our own: parallel shard workers may save the same store at once
+        fd, tmp_matrix = tempfile.mkstemp(dir=self.directory, suffix=".tmp.npy")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, matrix)
+        fd, tmp_index = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"model": self.model_name, "dtype": self.dtype.name, "ids": ids, "hashes": hashes}, f)
+        # Matrix first, then index: a crash in between leaves a stale index that sync() repairs
+        os.replace(tmp_matrix, self.matrix_path)
+        os.replace(tmp_index, self.index_path)
+
+    def sync(self, requirements: list[dict], print_logs=False) -> np.ndarray:
+        stored_matrix, stored_hashes = self._load()
+        stored_rows = {h: i for i, h in enumerate(stored_hashes)}
+        if stored_matrix is not None and stored_matrix.shape[0] != len(stored_hashes):
+            stored_matrix, stored_rows = None, {}
+
+        hashes = [_content_hash(r) for r in requirements]
+        self.fingerprint = hashlib.sha256("".join(hashes).encode("utf-8")).hexdigest()
+        if hashes == stored_hashes and stored_matrix is not None:
+            return stored_matrix
+
+        missing = [i for i, h in enumerate(hashes) if h not in stored_rows]
+        if print_logs:
+            print(f"🧮 Embedding store: {len(requirements) - len(missing)} reused, {len(missing)} to encode, "
+                  f"{len(set(stored_hashes) - set(hashes))} dropped")
+
+        new_vectors = None
+        if missing:
+            new_vectors = get_embedding_model(self.model_name).encode(
+                [requirement_embedding_text(requirements[i]) for i in missing],
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+            )
+
+        if stored_matrix is not None:
+            dim = stored_matrix.shape[1]
+        elif new_vectors is not None:
+            dim = new_vectors.shape[1]
+        else:
+            dim = 0
+        matrix = np.empty((len(requirements), dim), dtype=self.dtype)
+        reused = [(i, stored_rows[h]) for i, h in enumerate(hashes) if h in stored_rows]
+        if reused:
+            targets, sources = zip(*reused)
+            matrix[list(targets)] = stored_matrix[list(sources)]
+        if missing:
+            matrix[missing] = new_vectors
+        # Release the memory map before the file is replaced (required on Windows)
+        stored_matrix = None
+
+        self._save(matrix, [str(r["id"]) for r in requirements], hashes)
+        return np.load(self.matrix_path, mmap_mode="r")
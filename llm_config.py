@@ -1,17 +1,149 @@
 import os
+import contextlib
+import contextvars
+
+# Default number of in-flight requests per provider (override with LLM_MAX_CONCURRENCY)
+DEFAULT_MAX_CONCURRENCY = {
+    "openai": 8,
+    "mistral": 4,
+    "groq": 4,
+}
+
+def get_max_concurrency(provider: str) -> int:
+    """
+    Returns how many concurrent LLM requests may be sent to the given provider.
+    """
+    env_value = os.getenv("LLM_MAX_CONCURRENCY")
+    if env_value:
+        return max(1, int(env_value))
+    return DEFAULT_MAX_CONCURRENCY.get(provider, 4)
+
+# Per-provider token budgets used when packing requirements into prompts
+# (override with LLM_CONTEXT_WINDOW / LLM_MAX_OUTPUT_TOKENS)
+DEFAULT_TOKEN_LIMITS = {
+    "openai": {"context_window": 16385, "max_output_tokens": 2048},
+    "mistral": {"context_window": 32768, "max_output_tokens": 2048},
+    "groq": {"context_window": 32768, "max_output_tokens": 2048},
+}
+
+def get_token_limits(provider: str) -> dict:
+    """
+    Returns the context window, output budget and the expected output size
+    per matched requirement for the given provider.
+    """
+    limits = DEFAULT_TOKEN_LIMITS.get(provider, {"context_window": 8192, "max_output_tokens": 2048})
+    return {
+        "context_window": int(os.getenv("LLM_CONTEXT_WINDOW", limits["context_window"])),
+        "max_output_tokens": int(os.getenv("LLM_MAX_OUTPUT_TOKENS", limits["max_output_tokens"])),
+        "output_tokens_per_requirement": int(os.getenv("LLM_OUTPUT_TOKENS_PER_REQUIREMENT", "80")),
+    }
+
+def get_http_settings() -> dict:
+    """
+    Connection pooling / retry / streaming settings shared by all providers.
+    """
+    return {
+        "http2": os.getenv("LLM_HTTP2", "false").lower() in ("1", "true", "yes"),
+        "timeout": float(os.getenv("LLM_TIMEOUT", "60")),
+        "max_retries": int(os.getenv("LLM_MAX_RETRIES", "5")),
+        "backoff_base": float(os.getenv("LLM_BACKOFF_BASE", "1.0")),
+        "backoff_max": float(os.getenv("LLM_BACKOFF_MAX", "60")),
+        "stream": os.getenv("LLM_STREAM", "false").lower() in ("1", "true", "yes"),
+        "stream_retries": int(os.getenv("LLM_STREAM_RETRIES", "1")),
+    }
+
+# Cheap model per provider for the cascade's yes/no screen (override with LLM_SCREEN_MODEL)
+DEFAULT_SCREEN_MODELS = {
+    "openai": "gpt-4o-mini",
+    "mistral": "mistralai/ministral-3b",
+    "groq": "llama-3.1-8b-instant",
+}
+
+# Settings pinned for the current run (see llm_overrides); take precedence over the environment
+_overrides = contextvars.ContextVar("llm_overrides", default={})
+
+@contextlib.contextmanager
+def llm_overrides(**settings):
+    """
+    Pin environment settings (by variable name, e.g. LLM_PROVIDER=...,
+    OPENAI_API_KEY=..., LLM_ROUTES=...) for the code run inside the block
+    and the asyncio tasks it starts. Used by the Streamlit app so one
+    session's settings don't leak into, or change, another session's run.
+    """
+    token = _overrides.set({**_overrides.get(), **settings})
+    try:
+        yield
+    finally:
+        _overrides.reset(token)
+
+def get_overrides() -> dict:
+    """The settings pinned by llm_overrides for the current run."""
+    return _overrides.get()
+
+def _setting(name: str, default=None):
+    overrides = _overrides.get()
+    return overrides[name] if name in overrides else os.getenv(name, default)
+
+def get_screen_settings() -> dict:
+    """
+    Screening tier of the cascade mode: provider and model that pre-screen
+    (threat, requirement) pairs before the main model justifies the survivors,
+    and how many requirements go into one screening prompt.
+    """
+    provider = (os.getenv("LLM_SCREEN_PROVIDER") or _setting("LLM_PROVIDER", "openai")).lower()
+    return {
+        "provider": provider,
+        "model": os.getenv("LLM_SCREEN_MODEL") or DEFAULT_SCREEN_MODELS.get(provider),
+        "chunk_size": int(os.getenv("LLM_SCREEN_CHUNK_SIZE", "20")),
+        "tokens_per_requirement": int(os.getenv("LLM_SCREEN_TOKENS_PER_REQUIREMENT", "16")),
+    }
+
+def get_router_settings() -> dict:
+    """
+    Multi-provider routing (see llm_router.LLMRouter). LLM_ROUTES lists the
+    backends as "provider[:model]" entries, e.g. "openai, groq:llama3-70b-8192";
+    routing is off with fewer than two. LLM_HEDGE_QUANTILE (e.g. 0.95) turns
+    on hedged requests.
+    """
+    hedge_quantile = os.getenv("LLM_HEDGE_QUANTILE")
+    return {
+        "routes": _setting("LLM_ROUTES", ""),
+        "window": int(os.getenv("LLM_ROUTER_WINDOW", "50")),
+        "hedge_quantile": float(hedge_quantile) if hedge_quantile else None,
+        "hedge_min_samples": int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "10")),
+        "max_error_rate": float(os.getenv("LLM_ROUTER_MAX_ERROR_RATE", "0.5")),
+        "cooldown": float(os.getenv("LLM_ROUTER_COOLDOWN", "30")),
+    }
+
+# Environment variable holding each provider's API key
+API_KEY_ENV = {
+    "openai": "OPENAI_API_KEY",
+    "mistral": "OPENROUTER_API_KEY",
+    "groq": "GROQ_API_KEY",
+}
+
+def get_api_url(default_url: str) -> str:
+    """
+    Chat-completions endpoint; LLM_API_URL points any provider at another
+    OpenAI-compatible server (a proxy, a self-hosted model or the benchmark mock).
+    """
+    return os.getenv("LLM_API_URL") or default_url
 
 def get_llm_config(provider: str = None, model: str = None, api_key: str = None):
     """
-    Returns LLM config based on selected provider. Uses .env as fallback if values not provided.
+    Returns LLM config based on selected provider. Uses llm_overrides, then .env as fallback if values not provided.
     """
-    provider = (provider or os.getenv("LLM_PROVIDER", "openai")).lower()
+    provider = (provider or _setting("LLM_PROVIDER", "openai")).lower()
 
     if provider == "openai":
         return {
             "provider": "openai",
+            "max_concurrency": get_max_concurrency("openai"),
+            **get_token_limits("openai"),
+            **get_http_settings(),
             "model": model or "gpt-3.5-turbo",  # or "gpt-4.1-nano"
-            "api_key": api_key or os.getenv("OPENAI_API_KEY"),
-            "url": "https://api.openai.com/v1/chat/completions",
+            "api_key": api_key or _setting("OPENAI_API_KEY"),
+            "url": get_api_url("https://api.openai.com/v1/chat/completions"),
             "headers": lambda k: {
                 "Authorization": f"Bearer {k}"
             }
@@ -20,9 +152,12 @@ def get_llm_config(provider: str = None, model: str = None, api_key: str = None)
     elif provider == "mistral":
         return {
             "provider": "mistral",
+            "max_concurrency": get_max_concurrency("mistral"),
+            **get_token_limits("mistral"),
+            **get_http_settings(),
             "model": model or "mistralai/mistral-7b-instruct",
-            "api_key": api_key or os.getenv("OPENROUTER_API_KEY"),
-            "url": "https://openrouter.ai/api/v1/chat/completions",
+            "api_key": api_key or _setting("OPENROUTER_API_KEY"),
+            "url": get_api_url("https://openrouter.ai/api/v1/chat/completions"),
             "headers": lambda k: {
                 "Authorization": f"Bearer {k}",
                 "X-Title": "ThreatMatchingTool"
@@ -32,9 +167,12 @@ def get_llm_config(provider: str = None, model: str = None, api_key: str = None)
     elif provider == "groq":
         return {
             "provider": "groq",
+            "max_concurrency": get_max_concurrency("groq"),
+            **get_token_limits("groq"),
+            **get_http_settings(),
             "model": model or "mixtral-8x7b-32768",
-            "api_key": api_key or os.getenv("GROQ_API_KEY"),
-            "url": "https://api.groq.com/openai/v1/chat/completions",
+            "api_key": api_key or _setting("GROQ_API_KEY"),
+            "url": get_api_url("https://api.groq.com/openai/v1/chat/completions"),
             "headers": lambda k: {
                 "Authorization": f"Bearer {k}",
                 "Content-Type": "application/json"
@@ -1,25 +1,239 @@
 import json
-from llm_utils import call_llm
-from llm_threat_mapper import (
-    generate_llm_prompt,
-    get_threat_assets,
-    filter_requirements_by_assets,
-    is_requirement_relevant_to_threat,
-)
+import asyncio
+from llm_config import get_llm_config, get_screen_settings
+from llm_utils import call_llm, call_llm_async, stream_llm_async, response_cache_key
+from llm_cache import get_cache
+from stream_parser import MitigationStreamParser
+from run_manifest import requirement_key
+from token_counter import get_token_counter
+from prompt_builder import get_prompt_builder
+from metrics import get_metrics
 
-# New: Import tokenizer from Hugging Face
-from transformers import AutoTokenizer
-
-tokenizer = AutoTokenizer.from_pretrained("google/flan-t5-base")
-
-def count_tokens(text):
-    return len(tokenizer.encode(text))
+def count_prompt_tokens(threat, chunk, rmp_context, req_structure_hint, asset_list=None, provider=None):
+    """
+    Prompt size computed from its segments: the static system prompt and the
+    threat block (shared by every chunk of the threat) plus one memoized
+    count per requirement fragment.
+    """
+    builder = get_prompt_builder(rmp_context, req_structure_hint, asset_list)
+    with get_metrics().stage("token_count"):
+        return get_token_counter(provider).count_segments(
+            [builder.system_prompt, builder.threat_block(threat)] + [builder.requirement_block(req) for req in chunk]
+        )
 
 def chunk_list(items, chunk_size):
     """Yield successive chunks from a list."""
     for i in range(0, len(items), chunk_size):
         yield items[i:i + chunk_size]
 
+def _pack_requirements(base_tokens, requirements, builder, config, counter, threat_count=1):
+    prompt_budget = config["context_window"] - config["max_output_tokens"]
+    max_per_chunk = max(1, config["max_output_tokens"] // (config["output_tokens_per_requirement"] * threat_count))
+
+    chunk = []
+    used_tokens = base_tokens
+    for req in requirements:
+        req_tokens = counter.count(builder.requirement_block(req))
+        if chunk and (used_tokens + req_tokens > prompt_budget or len(chunk) >= max_per_chunk):
+            yield chunk
+            chunk = []
+            used_tokens = base_tokens
+        chunk.append(req)
+        used_tokens += req_tokens
+    if chunk:
+        yield chunk
+
+def pack_chunks(threat, requirements, rmp_context, req_structure_hint, config=None, asset_list=None):
+    """
+    Yield chunks of requirements sized to the provider's token budget instead
+    of a fixed chunk_size: each prompt is filled until prompt tokens plus the
+    output budget reach the context window, or until the expected output
+    (output_tokens_per_requirement each) would exceed max_output_tokens.
+    """
+    config = config or get_llm_config()
+    counter = get_token_counter(config["provider"])
+    builder = get_prompt_builder(rmp_context, req_structure_hint, asset_list)
+    base_tokens = counter.count_segments([builder.system_prompt, builder.threat_block(threat)])
+    return _pack_requirements(base_tokens, requirements, builder, config, counter)
+
+def get_chunks(threat, requirements, rmp_context, req_structure_hint, chunk_size=5, pack_tokens=False, asset_list=None):
+    """Split candidate requirements into prompt-sized chunks (fixed size or token-budget packing)."""
+    if pack_tokens:
+        with get_metrics().stage("token_count"):
+            return list(pack_chunks(threat, requirements, rmp_context, req_structure_hint, asset_list=asset_list))
+    return chunk_list(requirements, chunk_size)
+
+async def call_chunk_async(system_prompt, prompt, client, semaphore, use_cache=True, journal=None, usable=None,
+                           **journal_meta):
+    """
+    Send one chunk prompt, serving it from the run journal when this exact
+    request already completed in an earlier (interrupted) run, and recording
+    successful responses to the journal. Only answers `usable` accepts (any
+    but "[LLM ERROR]" if not given) are cached or journaled, so a broken one
+    is asked again on the next run.
+    """
+    usable = usable or (lambda response: not response.startswith("[LLM ERROR]"))
+    if journal is None:
+        return await call_llm_async(prompt, client, semaphore, use_cache=use_cache, system_prompt=system_prompt,
+                                    cacheable=usable)
+
+    config = get_llm_config()
+    key = journal.make_key(config["provider"], config["model"], system_prompt, prompt)
+    response = journal.get(key, usable)
+    if response is not None:
+        get_metrics().incr("journal_hits")
+    else:
+        response = await call_llm_async(prompt, client, semaphore, use_cache=use_cache, system_prompt=system_prompt,
+                                        cacheable=usable)
+        if usable(response):
+            journal.record(key, response, **journal_meta)
+    return response
+
+def parse_mitigations(llm_response, valid_ids=None):
+    """
+    Parse the structured JSON returned by the LLM into a list of
+    {"requirement", "justification"} dicts. Returns [] if parsing fails.
+    With valid_ids, requirements outside that set are dropped.
+    """
+    mitigations = []
+    if llm_response.startswith("[LLM ERROR]"):
+        print(f"❌ {llm_response}")
+        return mitigations
+    try:
+        parsed = json.loads(llm_response)
+        for entry in parsed.get("mitigations", []):
+            req_id = entry.get("requirement", "").strip()
+            justification = entry.get("justification", "").strip()
+            if req_id:
+                mitigations.append({"requirement": req_id, "justification": justification})
+    except Exception as e:
+        get_metrics().incr("parse_failures")
+        print(f"❌ JSON parsing failed: {e}")
+    if valid_ids is not None:
+        valid = {requirement_key(i) for i in valid_ids}
+        mitigations = [m for m in mitigations if requirement_key(m["requirement"]) in valid]
+    return mitigations
+
+def chunk_failed(llm_response) -> bool:
+    """
+    True when a chunk didn't get a usable answer: an "[LLM ERROR]" or anything
+    but a JSON object with a "mitigations" list. Such chunks aren't recorded
+    as done in the run manifest, so the next run sends them again.
+    """
+    if llm_response.startswith("[LLM ERROR]"):
+        return True
+    try:
+        parsed = json.loads(llm_response)
+    except ValueError:
+        return True
+    return not isinstance(parsed, dict) or not isinstance(parsed.get("mitigations"), list)
+
+# Rough characters per token, used to spot answers running past their output budget
+CHARS_PER_TOKEN = 4
+# Output tokens allowed for the JSON wrapper on top of the per-requirement budget
+STREAM_OVERHEAD_TOKENS = 64
+# Text tolerated after the closing brace before the stream is cut off
+STREAM_TRAILING_CHARS = 200
+
+async def call_chunk_streaming_async(system_prompt, prompt, requirements, client, semaphore, use_cache=True,
+                                     journal=None, print_logs=False, **journal_meta):
+    """
+    Streaming counterpart of call_chunk_async + parse_mitigations for one chunk.
+
+    The answer is streamed (SSE) and parsed incrementally: each mitigation is
+    accepted as soon as its object is complete, and IDs that weren't in the
+    chunk are rejected on the fly. max_tokens is sized to the chunk, and the
+    stream is closed early once every requirement has been answered or the
+    output runs past its budget / repeats itself. Only a chunk whose stream
+    failed or ended in broken JSON (including no {"mitigations": [...]}
+    object at all) is retried (LLM_STREAM_RETRIES times). Complete answers
+    are cached / journaled in the regular format.
+    Returns (mitigations, complete); complete is False when the chunk still
+    had no full answer after the retries, or its output was cut off as
+    runaway, so the run manifest doesn't record it as done.
+    """
+    config = get_llm_config()
+    metrics = get_metrics()
+    valid_ids = [req["id"] for req in requirements]
+    max_tokens = min(config["max_output_tokens"],
+                     config["output_tokens_per_requirement"] * len(requirements) + STREAM_OVERHEAD_TOKENS)
+
+    cache_key = response_cache_key(config, prompt, system_prompt, max_tokens=max_tokens)
+    journal_key = journal.make_key(config["provider"], config["model"], system_prompt, prompt) if journal else None
+    stored = journal.get(journal_key, lambda response: not chunk_failed(response)) if journal is not None else None
+    if stored is not None:
+        metrics.incr("journal_hits")
+    elif use_cache:
+        stored = get_cache().get(cache_key)
+        if stored is not None and chunk_failed(stored):
+            stored = None
+        metrics.incr("cache_misses" if stored is None else "cache_hits")
+    if stored is not None:
+        return parse_mitigations(stored, valid_ids), not chunk_failed(stored)
+
+    best = None
+    for attempt in range(config["stream_retries"] + 1):
+        parser = MitigationStreamParser(valid_ids)
+        finished = False
+        runaway = False
+        trailing = 0
+        stream = stream_llm_async(prompt, client, semaphore, max_tokens=max_tokens, system_prompt=system_prompt)
+        try:
+            async for delta in stream:
+                if finished:
+                    # Keep reading to the end of a complete answer (the usage event comes last),
+                    # unless the model carries on writing after the JSON
+                    trailing += len(delta)
+                    if trailing > STREAM_TRAILING_CHARS:
+                        metrics.incr("stream_cutoffs")
+                        break
+                    continue
+                parser.feed(delta)
+                if parser.done:
+                    finished = True
+                    continue
+                if parser.all_answered:
+                    metrics.incr("stream_cutoffs")
+                    finished = True
+                    break
+                if parser.duplicates > len(requirements) or parser.chars > max_tokens * CHARS_PER_TOKEN * 1.5:
+                    # Runaway output: keep what arrived, but it isn't a full answer to cache or journal
+                    metrics.incr("stream_cutoffs")
+                    runaway = True
+                    break
+        except Exception as e:
+            metrics.incr("llm_errors")
+            print(f"❌ [LLM ERROR] {e}")
+        finally:
+            await stream.aclose()
+
+        if parser.rejected:
+            metrics.incr("rejected_requirements", len(parser.rejected))
+            if print_logs:
+                print(f"🚫 Rejected requirement IDs not in the chunk: {parser.rejected}")
+        if finished:
+            text = parser.to_json()
+            if print_logs:
+                print(f"🔍 Streamed LLM response:\n{text}\n#############End LLM Response################")
+            if use_cache:
+                get_cache().set(cache_key, text)
+            if journal is not None:
+                journal.record(journal_key, text, **journal_meta)
+            return parser.mitigations, True
+        if runaway:
+            print(f"❌ Streamed answer cut off (repeating or over budget); kept {len(parser.mitigations)} mitigations")
+            return parser.mitigations, False
+
+        if best is None or len(parser.mitigations) > len(best.mitigations):
+            best = parser
+        if attempt < config["stream_retries"]:
+            metrics.incr("stream_chunk_retries")
+
+    # Still broken after the retries: keep whatever complete mitigations arrived
+    metrics.incr("parse_failures")
+    print(f"❌ Streamed answer incomplete; kept {len(best.mitigations)} mitigations")
+    return best.mitigations, False
+
 def match_threat_to_requirements(
         threat,
         filtered_requirements,
@@ -28,35 +242,266 @@ def match_threat_to_requirements(
         chunk_size=5,
         print_tokens=False,
         print_logs=False,
-        asset_list=None):
+        asset_list=None,
+        use_cache=True,
+        pack_tokens=False):
     """
     Given a threat, find matching requirements using asset filtering + LLM.
     Parses structured JSON output to collect both requirement IDs and justifications.
+    With pack_tokens, chunks are packed up to the provider's token budget
+    instead of holding chunk_size requirements each.
     """
 
-    threat_assets = get_threat_assets(threat.get("Interaction", ""), asset_list)
     mitigations = []
 
-    for chunk in chunk_list(filtered_requirements, chunk_size):
-        prompt = generate_llm_prompt(threat, chunk, rmp_context, req_structure_hint, asset_list=asset_list)
-        token_count = count_tokens(prompt)
+    builder = get_prompt_builder(rmp_context, req_structure_hint, asset_list)
+    for chunk in get_chunks(threat, filtered_requirements, rmp_context, req_structure_hint,
+                            chunk_size, pack_tokens, asset_list):
+        with get_metrics().stage("prompt_build"):
+            system_prompt, prompt = builder.build(threat, chunk)
+        if print_tokens:
+            token_count = count_prompt_tokens(threat, chunk, rmp_context, req_structure_hint, asset_list)
+            print(f"🔢 $$$$$$$$$$$Token count for chunk:$$$$$$$$$$$$$$$$$$ {token_count}")
+
+        llm_response = call_llm(prompt, use_cache=use_cache, system_prompt=system_prompt,
+                                cacheable=lambda response: not chunk_failed(response))
+
+        if print_logs:
+            print(f"🔍 Raw LLM response:\n{llm_response}\n#############End LLM Response################")
+
+        with get_metrics().stage("parse"):
+            mitigations.extend(parse_mitigations(llm_response))
+
+    return mitigations  # List of dicts with requirement + justification
+
+async def match_threat_to_requirements_async(
+        threat,
+        filtered_requirements,
+        rmp_context,
+        req_structure_hint,
+        client,
+        semaphore,
+        chunk_size=5,
+        print_tokens=False,
+        print_logs=False,
+        asset_list=None,
+        use_cache=True,
+        pack_tokens=False,
+        journal=None,
+        stream=False):
+    """
+    Async version of match_threat_to_requirements: all chunks of the threat
+    are sent concurrently (bounded by the shared semaphore) and the parsed
+    mitigations are returned in chunk order. Chunks already recorded in the
+    run journal (if given) are not sent again. With stream=True answers are
+    streamed and parsed incrementally (see call_chunk_streaming_async).
 
+    Returns (mitigations, failed): failed holds the requirement keys of the
+    chunks that got no usable answer (see chunk_failed).
+    """
+    builder = get_prompt_builder(rmp_context, req_structure_hint, asset_list)
+    prompts = []
+    chunks = []
+    for chunk in get_chunks(threat, filtered_requirements, rmp_context, req_structure_hint,
+                            chunk_size, pack_tokens, asset_list):
         if print_tokens:
+            token_count = count_prompt_tokens(threat, chunk, rmp_context, req_structure_hint, asset_list)
             print(f"🔢 $$$$$$$$$$$Token count for chunk:$$$$$$$$$$$$$$$$$$ {token_count}")
+        with get_metrics().stage("prompt_build"):
+            prompts.append(builder.build(threat, chunk))
+        chunks.append(chunk)
+
+    if stream:
+        per_chunk = await asyncio.gather(*(
+            call_chunk_streaming_async(system_prompt, prompt, chunk, client, semaphore, use_cache, journal,
+                                       print_logs, threat_id=str(threat["Id"]), chunk=n)
+            for n, ((system_prompt, prompt), chunk) in enumerate(zip(prompts, chunks))
+        ))
+        failed = {requirement_key(r["id"]) for chunk, (_, complete) in zip(chunks, per_chunk)
+                  if not complete for r in chunk}
+        return [m for mitigations, _ in per_chunk for m in mitigations], failed
 
-        llm_response = call_llm(prompt)
+    responses = await asyncio.gather(*(
+        call_chunk_async(system_prompt, prompt, client, semaphore, use_cache, journal,
+                         usable=lambda response: not chunk_failed(response), threat_id=str(threat["Id"]), chunk=n)
+        for n, (system_prompt, prompt) in enumerate(prompts)
+    ))
 
+    mitigations = []
+    failed = set()
+    for chunk, llm_response in zip(chunks, responses):
         if print_logs:
             print(f"🔍 Raw LLM response:\n{llm_response}\n#############End LLM Response################")
+        with get_metrics().stage("parse"):
+            mitigations.extend(parse_mitigations(llm_response))
+            if chunk_failed(llm_response):
+                failed.update(requirement_key(r["id"]) for r in chunk)
 
-        try:
-            parsed = json.loads(llm_response)
-            for entry in parsed.get("mitigations", []):
+    return mitigations, failed
+
+def screen_answered(llm_response) -> bool:
+    """True for a screening answer that is a JSON object with a "relevant" list."""
+    if llm_response.startswith("[LLM ERROR]"):
+        return False
+    try:
+        parsed = json.loads(llm_response)
+    except ValueError:
+        return False
+    return isinstance(parsed, dict) and isinstance(parsed.get("relevant"), list)
+
+def parse_screen(llm_response, requirements):
+    """
+    Requirements kept by a screening answer ({"relevant": [IDs]}). Fails open:
+    on an error or an unparseable answer the whole chunk is kept.
+    """
+    if llm_response.startswith("[LLM ERROR]"):
+        print(f"❌ {llm_response}")
+        return list(requirements)
+    try:
+        kept = {requirement_key(i) for i in json.loads(llm_response).get("relevant", [])}
+    except Exception as e:
+        get_metrics().incr("parse_failures")
+        print(f"❌ JSON parsing failed: {e}")
+        return list(requirements)
+    return [r for r in requirements if requirement_key(r["id"]) in kept]
+
+async def screen_requirements_async(
+        threat,
+        requirements,
+        rmp_context,
+        req_structure_hint,
+        client,
+        semaphore,
+        print_logs=False,
+        asset_list=None,
+        use_cache=True):
+    """
+    Cascade screening tier: a cheap model (see llm_config.get_screen_settings)
+    answers only which candidates could mitigate the threat, in chunks of
+    the screen's chunk size. Returns the candidates that pass, in order;
+    only those are sent to the main model for justification.
+    """
+    settings = get_screen_settings()
+    builder = get_prompt_builder(rmp_context, req_structure_hint, asset_list)
+    chunks = list(chunk_list(requirements, settings["chunk_size"]))
+
+    async def screen_chunk(chunk):
+        with get_metrics().stage("prompt_build"):
+            system_prompt, prompt = builder.build_screen(threat, chunk)
+        response = await call_llm_async(
+            prompt, client, semaphore, provider=settings["provider"], model=settings["model"],
+            max_tokens=settings["tokens_per_requirement"] * len(chunk) + 32, use_cache=use_cache,
+            print_logs=print_logs, system_prompt=system_prompt, cacheable=screen_answered
+        )
+        with get_metrics().stage("parse"):
+            return parse_screen(response, chunk)
+
+    kept = [r for passed in await asyncio.gather(*(screen_chunk(c) for c in chunks)) for r in passed]
+    metrics = get_metrics()
+    metrics.incr("screen_passed", len(kept))
+    metrics.incr("screen_rejected", len(requirements) - len(kept))
+    if print_logs:
+        print(f"🪜 Screen kept {len(kept)} of {len(requirements)} candidates for threat {threat.get('Id')}")
+    return kept
+
+def batch_answered(llm_response, threat_ids) -> set:
+    """IDs of the threats that have a list in a multi-threat answer (none for errors / broken JSON)."""
+    if llm_response.startswith("[LLM ERROR]"):
+        return set()
+    try:
+        parsed = json.loads(llm_response)
+    except ValueError:
+        return set()
+    answers = parsed.get("threats") if isinstance(parsed, dict) else None
+    if not isinstance(answers, dict):
+        return set()
+    return {threat_id for threat_id in threat_ids if isinstance(answers.get(threat_id), list)}
+
+def parse_batch_mitigations(llm_response, threat_ids):
+    """
+    Parse a multi-threat response ({"threats": {threat_id: [...]}}) into
+    {threat_id: [mitigations]}. Threats missing from the response get [].
+    """
+    results = {threat_id: [] for threat_id in threat_ids}
+    if llm_response.startswith("[LLM ERROR]"):
+        print(f"❌ {llm_response}")
+        return results
+    try:
+        parsed = json.loads(llm_response).get("threats", {})
+        for threat_id in threat_ids:
+            for entry in parsed.get(threat_id) or []:
                 req_id = entry.get("requirement", "").strip()
                 justification = entry.get("justification", "").strip()
                 if req_id:
-                    mitigations.append({"requirement": req_id, "justification": justification})
-        except Exception as e:
-            print(f"❌ JSON parsing failed: {e}")
+                    results[threat_id].append({"requirement": req_id, "justification": justification})
+    except Exception as e:
+        get_metrics().incr("parse_failures")
+        print(f"❌ JSON parsing failed: {e}")
+    return results
 
-    return mitigations  # List of dicts with requirement + justification
+async def match_threat_batch_async(
+        threats,
+        filtered_requirements,
+        rmp_context,
+        req_structure_hint,
+        client,
+        semaphore,
+        chunk_size=5,
+        print_tokens=False,
+        print_logs=False,
+        asset_list=None,
+        use_cache=True,
+        pack_tokens=False,
+        journal=None):
+    """
+    Map several threats that share the same candidate requirements with one
+    prompt per chunk. Threat IDs must be unique within the batch.
+    Returns one (mitigations, failed) pair per threat, in the order given;
+    failed holds the requirement keys of chunks that threat got no answer for.
+    """
+    threat_ids = [str(threat["Id"]) for threat in threats]
+    builder = get_prompt_builder(rmp_context, req_structure_hint, asset_list)
+    counter = get_token_counter()
+    threats_block = builder.threats_block(threats)
+
+    if pack_tokens:
+        config = get_llm_config()
+        with get_metrics().stage("token_count"):
+            base_tokens = counter.count_segments([builder.batch_system_prompt, threats_block])
+            chunks = list(_pack_requirements(base_tokens, filtered_requirements, builder, config, counter,
+                                             threat_count=len(threats)))
+    else:
+        chunks = list(chunk_list(filtered_requirements, chunk_size))
+
+    prompts = []
+    for chunk in chunks:
+        if print_tokens:
+            with get_metrics().stage("token_count"):
+                token_count = counter.count_segments(
+                    [builder.batch_system_prompt, threats_block] + [builder.requirement_block(r) for r in chunk]
+                )
+            print(f"🔢 $$$$$$$$$$$Token count for batch chunk:$$$$$$$$$$$$$$$$$$ {token_count}")
+        with get_metrics().stage("prompt_build"):
+            prompts.append(builder.build_batch(threats, chunk))
+
+    responses = await asyncio.gather(*(
+        call_chunk_async(system_prompt, prompt, client, semaphore, use_cache, journal,
+                         usable=lambda response: batch_answered(response, threat_ids) == set(threat_ids),
+                         threat_id=threat_ids, chunk=n)
+        for n, (system_prompt, prompt) in enumerate(prompts)
+    ))
+
+    mitigations = {threat_id: [] for threat_id in threat_ids}
+    failed = {threat_id: set() for threat_id in threat_ids}
+    for chunk, llm_response in zip(chunks, responses):
+        if print_logs:
+            print(f"🔍 Raw LLM response:\n{llm_response}\n#############End LLM Response################")
+        with get_metrics().stage("parse"):
+            parsed = parse_batch_mitigations(llm_response, threat_ids)
+            answered = batch_answered(llm_response, threat_ids)
+        for threat_id, entries in parsed.items():
+            mitigations[threat_id].extend(entries)
+            if threat_id not in answered:
+                failed[threat_id].update(requirement_key(r["id"]) for r in chunk)
+
+    return [(mitigations[threat_id], failed[threat_id]) for threat_id in threat_ids]
@@ -0,0 +1,285 @@
+import time
+import asyncio
+import contextlib
+import threading
+from collections import deque
+import httpx
+from llm_config import get_llm_config, get_overrides, get_router_settings
+from llm_utils import build_llm_request, get_http_client, retry_after_seconds, _retry_delay, RETRY_STATUS_CODES
+from metrics import get_metrics
+
+def parse_routes(spec: str) -> list:
+    """Parse "openai, groq:llama3-70b-8192, mistral" into [(provider, model or None), ...]."""
+    routes = []
+    for entry in (spec or "").split(","):
+        provider, _, model = entry.strip().partition(":")
+        if provider:
+            routes.append((provider.strip().lower(), model.strip() or None))
+    return routes
+
+class BackendUnavailable(Exception):
+    """A backend answered 429/5xx; `retry_after` is how long to leave it alone."""
+
+    def __init__(self, config, status_code, retry_after):
+        super().__init__(f"{config['provider']}/{config['model']} returned {status_code}")
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+class BackendStats:
+    """Rolling latency / error window of one provider+model."""
+
+    def __init__(self, window=50):
+        self.latencies = deque(maxlen=window)
+        self.errors = deque(maxlen=window)
+        self.cooldown_until = 0.0
+
+    def record(self, latency=None, error=False, cooldown=0.0):
+        if latency is not None:
+            self.latencies.append(latency)
+        self.errors.append(bool(error))
+        if cooldown:
+            self.cooldown_until = max(self.cooldown_until, time.monotonic() + cooldown)
+
+    @property
+    def error_rate(self) -> float:
+        return sum(self.errors) / len(self.errors) if self.errors else 0.0
+
+    def percentile(self, q: float):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def healthy(self, max_error_rate: float) -> bool:
+        return time.monotonic() >= self.cooldown_until and self.error_rate <= max_error_rate
+
+    def score(self) -> float:
+        # Expected seconds per successful answer; backends without samples go first so they get measured
+        median = self.percentile(0.5)
+        if median is None:
+            return 0.0
+        return median / max(1.0 - self.error_rate, 0.05)
+
+class LLMRouter:
+    """
+    Sends each request to the currently fastest healthy backend of several
+    provider/model routes (see parse_routes), based on a rolling window of
+    latencies and errors per backend.
+
+    - A 429/5xx or transport error puts the backend in cooldown (Retry-After,
+      or `cooldown` seconds) and the request fails over to the next backend;
+      once every backend failed, the round is retried with backoff.
+    - With hedge_quantile (e.g. 0.95), a duplicate request goes to the next
+      backend once the first one has been in flight longer than that latency
+      percentile of its window; the first answer wins, the other is cancelled.
+    """
+
+    def __init__(self, routes, window=50, hedge_quantile=None, hedge_min_samples=10,
+                 max_error_rate=0.5, cooldown=30.0):
+        configs = [get_llm_config(provider, model) for provider, model in routes]
+        self.backends = [c for c in configs if c.get("api_key")]
+        if not self.backends:
+            raise ValueError("LLM_ROUTES: no route has an API key")
+        self.stats = {self.name(c): BackendStats(window) for c in self.backends}
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.max_error_rate = max_error_rate
+        self.cooldown = cooldown
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+
+    @staticmethod
+    def name(config) -> str:
+        return f"{config['provider']}/{config['model']}"
+
+    @property
+    def cache_config(self) -> dict:
+        """Provider/model under which routed answers are cached (the whole route set)."""
+        return {"provider": "router", "model": ",".join(self.name(c) for c in self.backends)}
+
+    def ranked(self) -> list:
+        """Backends best first: healthy ones by score, then the rest by when their cooldown ends."""
+        def key(config):
+            stats = self.stats[self.name(config)]
+            if stats.healthy(self.max_error_rate):
+                return (0, stats.score())
+            return (1, stats.cooldown_until, stats.error_rate)
+        return sorted(self.backends, key=key)
+
+    def hedge_delay(self, config):
+        if self.hedge_quantile is None:
+            return None
+        stats = self.stats[self.name(config)]
+        if len(stats.latencies) < self.hedge_min_samples:
+            return None
+        return stats.percentile(self.hedge_quantile)
+
+    def _failed(self, config, response=None) -> float:
+        """Record a failed attempt; the backend is skipped for Retry-After (or `cooldown`) seconds."""
+        retry_after = retry_after_seconds(response, config)
+        cooldown = self.cooldown if retry_after is None else retry_after
+        self.stats[self.name(config)].record(error=True, cooldown=cooldown)
+        return cooldown
+
+    def _succeeded(self, config, latency):
+        self.stats[self.name(config)].record(latency)
+        get_metrics().observe_attempt(config["provider"], config["model"], latency)
+
+    async def _attempt_async(self, client, semaphore, config, prompt, max_tokens, temperature, system_prompt,
+                             sent=None):
+        # `sent` is set once the request is on the wire, so hedge timers don't count semaphore queueing.
+        # A cancelled attempt (the loser of a hedge race) records no latency: its time so far is only
+        # a lower bound and would make a slow backend look faster than it is
+        headers, payload = build_llm_request(prompt, config, max_tokens, temperature, system_prompt)
+        try:
+            async with semaphore or contextlib.nullcontext():
+                started = time.perf_counter()
+                if sent is not None:
+                    sent.set()
+                response = await client.post(config["url"], headers=headers, json=payload)
+        except httpx.TransportError:
+            self._failed(config)
+            raise
+        if response.status_code in RETRY_STATUS_CODES:
+            get_metrics().observe_attempt(config["provider"], config["model"], time.perf_counter() - started)
+            raise BackendUnavailable(config, response.status_code, self._failed(config, response))
+        response.raise_for_status()
+        self._succeeded(config, time.perf_counter() - started)
+        return config, response.json()
+
+    async def _hedged_async(self, client, semaphore, primary, backup, request):
+        delay = self.hedge_delay(primary)
+        if delay is None:
+            return await self._attempt_async(client, semaphore, primary, *request)
+
+        sent = asyncio.Event()
+        first = asyncio.ensure_future(self._attempt_async(client, semaphore, primary, *request, sent=sent))
+        pending = {first}
+        try:
+            waiter = asyncio.ensure_future(sent.wait())
+            await asyncio.wait({first, waiter}, return_when=asyncio.FIRST_COMPLETED)
+            waiter.cancel()
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return first.result()
+
+            self.hedges += 1
+            get_metrics().incr("llm_hedges")
+            second = asyncio.ensure_future(self._attempt_async(client, semaphore, backup, *request))
+            pending = {first, second}
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self.hedge_wins += 1
+                            get_metrics().incr("llm_hedge_wins")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # The slower request (or both, if we were cancelled) is dropped
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def call_async(self, prompt, client, semaphore=None, max_tokens=2048, temperature=0.0,
+                         system_prompt=None) -> tuple:
+        """
+        Send one chat completion through the router; returns (config of the
+        backend that answered, response body). Raises the last error once
+        every retry round failed on every backend.
+        """
+        request = (prompt, max_tokens, temperature, system_prompt)
+        metrics = get_metrics()
+        max_retries = self.backends[0]["max_retries"]
+        error = None
+        for attempt in range(max_retries + 1):
+            if attempt:
+                metrics.incr("llm_retries")
+            ranked = self.ranked()
+            for i, config in enumerate(ranked):
+                if i:
+                    self.failovers += 1
+                    metrics.incr("llm_failovers")
+                backup = ranked[i + 1] if i + 1 < len(ranked) else config
+                try:
+                    return await self._hedged_async(client, semaphore, config, backup, request)
+                except (BackendUnavailable, httpx.TransportError) as e:
+                    error = e
+            if attempt < max_retries:
+                await asyncio.sleep(_retry_delay(attempt, self.backends[0]))
+        raise error
+
+    def call(self, prompt, max_tokens=2048, temperature=0.0, system_prompt=None) -> tuple:
+        """Synchronous call_async without hedging (failover and retry rounds only)."""
+        metrics = get_metrics()
+        max_retries = self.backends[0]["max_retries"]
+        error = None
+        for attempt in range(max_retries + 1):
+            if attempt:
+                metrics.incr("llm_retries")
+            for i, config in enumerate(self.ranked()):
+                if i:
+                    self.failovers += 1
+                    metrics.incr("llm_failovers")
+                headers, payload = build_llm_request(prompt, config, max_tokens, temperature, system_prompt)
+                started = time.perf_counter()
+                try:
+                    response = get_http_client(config).post(config["url"], headers=headers, json=payload)
+                except httpx.TransportError as e:
+                    self._failed(config)
+                    error = e
+                    continue
+                if response.status_code in RETRY_STATUS_CODES:
+                    metrics.observe_attempt(config["provider"], config["model"], time.perf_counter() - started)
+                    error = BackendUnavailable(config, response.status_code, self._failed(config, response))
+                    continue
+                response.raise_for_status()
+                self._succeeded(config, time.perf_counter() - started)
+                return config, response.json()
+            if attempt < max_retries:
+                time.sleep(_retry_delay(attempt, self.backends[0]))
+        raise error
+
+    def report(self) -> dict:
+        """Rolling stats per backend plus hedge / failover counters."""
+        return {
+            "backends": {
+                name: {
+                    "p50_s": stats.percentile(0.5),
+                    "p95_s": stats.percentile(0.95),
+                    "error_rate": round(stats.error_rate, 3),
+                    "healthy": stats.healthy(self.max_error_rate),
+                }
+                for name, stats in self.stats.items()
+            },
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "failovers": self.failovers,
+        }
+
+_routers = {}
+_router_lock = threading.Lock()
+
+def get_router():
+    """
+    The shared LLMRouter for LLM_ROUTES, or None when routing is off (a
+    single route is just the regular single-provider path). Runs pinned to
+    other settings or keys (llm_config.llm_overrides) get their own router.
+    """
+    settings = get_router_settings()
+    routes = parse_routes(settings["routes"])
+    if len(routes) < 2:
+        return None
+    spec = (tuple(sorted(settings.items())), tuple(sorted(get_overrides().items())))
+    with _router_lock:
+        if spec not in _routers:
+            _routers[spec] = LLMRouter(
+                routes, window=settings["window"], hedge_quantile=settings["hedge_quantile"],
+                hedge_min_samples=settings["hedge_min_samples"], max_error_rate=settings["max_error_rate"],
+                cooldown=settings["cooldown"]
+            )
+        return _routers[spec]
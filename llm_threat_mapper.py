@@ -1,143 +1,180 @@
+import os
 import re
-from sentence_transformers import SentenceTransformer, util
-
-# Load embedding model once
-model = SentenceTransformer("all-MiniLM-L6-v2")
+import glob
+import json
+import hashlib
+from collections import defaultdict
+import numpy as np
+from model_registry import get_embedding_model, DEFAULT_EMBEDDING_MODEL
+from embedding_store import EmbeddingStore
+
+# Reference sentence describing what a mitigation looks like for each STRIDE category
+CANONICAL_MITIGATIONS = {
+    "elevation of privilege": "requirement must enforce privilege separation and authorization",
+    "spoofing": "requirement must authenticate and verify identity",
+    "information disclosure": "requirement must ensure confidentiality through encryption or access control",
+    "tampering": "requirement must preserve data integrity and resist tampering",
+    "repudiation": "requirement must support audit logging and traceability",
+    "denial of service": "requirement must protect availability and throttle excessive input"
+}
+
+_reference_embeddings = {}
+
+def get_reference_embeddings(model_name=DEFAULT_EMBEDDING_MODEL) -> np.ndarray:
+    """Normalized embeddings of the CANONICAL_MITIGATIONS sentences (computed once per model)."""
+    if model_name not in _reference_embeddings:
+        _reference_embeddings[model_name] = get_embedding_model(model_name).encode(
+            list(CANONICAL_MITIGATIONS.values()), convert_to_numpy=True, normalize_embeddings=True
+        ).astype(np.float32)
+    return _reference_embeddings[model_name]
 
 def generate_llm_prompt(threat, filtered_requirements, rmp_context, req_structure_hint, asset_list=None):
-    import yaml
-    from llm_threat_mapper import get_threat_assets
-
-    threat_assets = get_threat_assets(threat.get("Interaction", ""), asset_list)
-    asset_hint = ", ".join(threat_assets)
-
-    threat_yaml = yaml.dump({
-        "ID": threat["Id"],
-        "Title": threat["Title"],
-        "Category": threat["Category"],
-        "Interaction": threat["Interaction"],
-        "Description": threat["Description"]
-    }, default_flow_style=False)
-
-    candidate_reqs_yaml = yaml.dump([
-        {"ID": r["id"], "Text": r["text"]}
-        for r in filtered_requirements
-    ], default_flow_style=False)
-
-    instructions = f"""
-You are given two YAML blocks: one called `Threat`, and one called `CandidateRequirements`.
-
-Your job is to:
-- ONLY include requirements that **explicitly and functionally** mitigate the described threat.
-- Consider that all CandidateRequirements are already **filtered by asset relevance**: they are allocated to these assets → {asset_hint}
-- Match requirements **based on semantic alignment** with the threat **Category** (e.g., Elevation Of Privilege, Information Disclosure, etc.)
-- Explain how the requirement mitigates the threat **in function**, not just keyword overlap.
-
-Output format MUST be in JSON. The JSON should be an object with a single key "mitigations", whose value is a list of objects. Each object in this list MUST have the following keys:
-- "requirement": (string) — a single requirement ID such as "[AVP_PCyA_2099]"
-- "justification": (string) — an explanation of how this requirement mitigates the given threat.
-
-If, and only if, NO requirements are found that effectively mitigate the given threat, the "mitigations" list SHOULD be empty. DO NOT return "None", "Not Applicable", or similar strings within the list items if no mitigations are found. Instead, return an empty list.
-
-Example expected JSON structure for mitigations found:
-{{
-  "mitigations": [
-    {{
-      "requirement": "[AVP_PCyA_2099]",
-      "justification": "TLS client authentication ensures only authorized entities (like Switch) are allowed to interact with vCenter."
-    }},
-    {{
-      "requirement": "[AVP_PCyA_2527]",
-      "justification": "RBAC restricts access based on predefined roles, limiting what impersonated users can do."
-    }}
-  ]
-}}
-
-Example expected JSON structure when NO mitigations are found:
-{{
-  "mitigations": []
-}}
-
-Requirement Metadata Notes:
-{rmp_context}
-
-Requirement Format Hint:
-{req_structure_hint}
-Very important instructions:
-- Your entire response MUST ONLY be a valid JSON block that strictly follows the structure below.
-- DO NOT explain your reasoning outside the JSON.
-- DO NOT write any introduction, summary, or commentary before or after the JSON.
-- DO NOT format the JSON as Markdown (no triple backticks).
-- Just respond with raw JSON.
-
-The required JSON structure is:
-
-{{
-  "mitigations": [
-    {{
-      "requirement": "[requirement_id]",
-      "justification": "Short but precise justification."
-    }}
-  ]
-}}
-
-If no requirement matches, return:
-
-{{
-  "mitigations": []
-}}
-
-"""
-
-    prompt = f"""{instructions.strip()}
-
-Threat:
-{threat_yaml}
-
-CandidateRequirements:
-{candidate_reqs_yaml}
-"""
-    return prompt.strip()
- 
-
-def get_threat_assets(interaction: str, asset_list=None) -> list:
     """
-    Extract asset names from interaction like 'AssetA to AssetB: description'.
-    Ignores everything after ':' and filters against known assets (case-insensitive).
+    Full prompt text (system instructions + threat + candidates) for one threat.
+    The LLM calls use prompt_builder directly to send the static part as the system message.
     """
-    if asset_list is None:
-        asset_list = {
-            "vCenter Server", "Switch", "Firewall", "NTP", "OS ESXi", "Harvester",
-            "Exported CSP", "OS Linux", "OS Windows", "vCenter", "Workstation",
-            "Exported Projects", "BR Solution", "AVP Application Suite"
-        }
+    from prompt_builder import get_prompt_builder
 
-    # Remove description part after the colon (if any)
-    interaction = interaction.split(":", 1)[0].strip()
+    system_prompt, user_prompt = get_prompt_builder(rmp_context, req_structure_hint, asset_list).build(
+        threat, filtered_requirements
+    )
+    return f"{system_prompt}\n\n{user_prompt}"
 
-    # Extract tokens around 'to' (with any amount of surrounding whitespace)
-    match = re.split(r"\s+to\s+", interaction, maxsplit=1, flags=re.IGNORECASE)
+# Assets recognised when no asset list is given
+DEFAULT_ASSETS = (
+    "vCenter Server", "Switch", "Firewall", "NTP", "OS ESXi", "Harvester",
+    "Exported CSP", "OS Linux", "OS Windows", "vCenter", "Workstation",
+    "Exported Projects", "BR Solution", "AVP Application Suite",
+)
 
-    normalized_assets = {a.lower(): a for a in asset_list}  # keep original casing
+class AssetMatcher:
+    """
+    Finds known asset names in Interaction strings, compiled once per asset list.
+
+    All names go into one case-insensitive regex (longest name first, so
+    "vCenter Server" wins over "vCenter"; any run of whitespace matches the
+    spaces inside multi-word names), and one left-to-right scan finds every
+    mention, whether it is a whole "X to Y" endpoint or embedded in free text
+    like "Admin Workstation (OS Windows)". Results are memoized per
+    interaction.
+    """
 
-    found_assets = []
-    for token in match:
-        token_clean = token.strip().lower()
-        if token_clean in normalized_assets:
-            found_assets.append(normalized_assets[token_clean])
+    def __init__(self, asset_list):
+        self.assets = {normalize_asset(a): a for a in asset_list if str(a).strip()}  # keep original casing
+        names = sorted(self.assets, key=len, reverse=True)
+        alternation = "|".join(r"\s+".join(re.escape(word) for word in name.split()) for name in names)
+        self.pattern = re.compile(rf"(?<!\w)(?:{alternation})(?!\w)", re.IGNORECASE) if names else None
+        self._memo = {}
+
+    def extract(self, interaction: str) -> list:
+        """Assets mentioned in the part before ':' (the flow label after it is ignored), in order of appearance."""
+        interaction = str(interaction or "")
+        found = self._memo.get(interaction)
+        if found is None:
+            endpoints = interaction.split(":", 1)[0]
+            found = []
+            if self.pattern is not None:
+                for match in self.pattern.finditer(endpoints):
+                    asset = self.assets[normalize_asset(match.group(0))]
+                    if asset not in found:
+                        found.append(asset)
+            self._memo[interaction] = found
+        return list(found)
+
+_asset_matchers = {}
+
+def get_asset_matcher(asset_list=None) -> AssetMatcher:
+    """Return the AssetMatcher for this asset list (DEFAULT_ASSETS if None), compiling it on first use."""
+    key = tuple(DEFAULT_ASSETS if asset_list is None else asset_list)
+    matcher = _asset_matchers.get(key)
+    if matcher is None:
+        matcher = _asset_matchers.setdefault(key, AssetMatcher(key))
+    return matcher
 
-    return found_assets
+def get_threat_assets(interaction: str, asset_list=None) -> list:
+    """
+    Extract asset names from interaction like 'AssetA to AssetB: description'.
+    Ignores everything after ':' and finds known assets (case-insensitive)
+    anywhere in the rest; see AssetMatcher.
+    """
+    return get_asset_matcher(asset_list).extract(interaction)
+
+# Alias -> asset names it should also match (applied in both directions, not transitively).
+# Override with a JSON file of the same shape via ASSET_ALIASES_FILE.
+DEFAULT_ASSET_ALIASES = {
+    "switchstack": ["switch"],
+    "hypervisor": ["esxi", "os esxi", "harvester"],
+    "virtual storage": ["vsan"],
+    "vcenter server": ["vcenter"],
+}
+
+def get_asset_aliases() -> dict:
+    aliases_file = os.getenv("ASSET_ALIASES_FILE")
+    if aliases_file and os.path.exists(aliases_file):
+        with open(aliases_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return DEFAULT_ASSET_ALIASES
+
+def normalize_asset(name: str) -> str:
+    return " ".join(str(name).lower().split())
+
+def split_assets(assets) -> list:
+    """Split an 'Assets Allocated to' cell into normalized asset names."""
+    if not isinstance(assets, str):
+        return []
+    return [normalize_asset(a) for a in re.split(r'[,|\n]+', assets) if a.strip()]
+
+class AssetIndex:
+    """
+    Inverted index from normalized asset name to the positions of the
+    requirements allocated to it, built once per requirement set.
+    Looking up a threat's assets is a union of posting lists, widened with
+    the alias table (e.g. a "Hypervisor" threat also matches "ESXi").
+    """
 
-def filter_requirements_by_assets(requirements, threat_assets):
+    def __init__(self, requirements: list[dict], aliases: dict = None):
+        self.requirements = requirements
+        self.postings = defaultdict(list)
+        for i, req in enumerate(requirements):
+            for asset in dict.fromkeys(split_assets(req["assets"])):
+                self.postings[asset].append(i)
+
+        self.related = defaultdict(set)
+        for alias, names in (get_asset_aliases() if aliases is None else aliases).items():
+            for name in names:
+                self.related[normalize_asset(alias)].add(normalize_asset(name))
+                self.related[normalize_asset(name)].add(normalize_asset(alias))
+
+    def expand(self, threat_assets) -> set:
+        keys = set()
+        for asset in threat_assets:
+            key = normalize_asset(asset)
+            keys.add(key)
+            keys |= self.related.get(key, set())
+        return keys
+
+    def lookup(self, threat_assets) -> list[dict]:
+        """Requirements allocated to any of the threat assets (or their aliases), in catalogue order."""
+        positions = set()
+        for key in self.expand(threat_assets):
+            positions.update(self.postings.get(key, ()))
+        return [self.requirements[i] for i in sorted(positions)]
+
+def filter_requirements_by_assets(requirements, threat_assets, asset_index: AssetIndex = None):
     """
     Return only requirements that reference one or more of the threat-involved assets.
-    Comparison is case-insensitive.
+    Comparison is case-insensitive. Pass an AssetIndex built once from the
+    same requirements to avoid re-splitting every requirement per threat
+    and to apply the asset alias table.
     """
+    if asset_index is not None:
+        return asset_index.lookup(threat_assets)
+
     filtered = []
-    threat_assets_lower = [a.lower() for a in threat_assets]
+    threat_assets_lower = [normalize_asset(a) for a in threat_assets]
 
     for req in requirements:
-        allocated_assets = [a.strip().lower() for a in re.split(r'[,|\n]+', req["assets"])]
+        allocated_assets = split_assets(req["assets"])
         if any(asset in allocated_assets for asset in threat_assets_lower):
             filtered.append(req)
 
@@ -146,19 +183,55 @@ def filter_requirements_by_assets(requirements, threat_assets):
 def is_requirement_relevant_to_threat(threat_category, req_text):
     """
     Use semantic similarity to determine if the requirement aligns with the STRIDE category.
+    For many requirements at once, use CategoryRelevanceIndex instead.
     """
-    canonical_mitigation = {
-        "elevation of privilege": "requirement must enforce privilege separation and authorization",
-        "spoofing": "requirement must authenticate and verify identity",
-        "information disclosure": "requirement must ensure confidentiality through encryption or access control",
-        "tampering": "requirement must preserve data integrity and resist tampering",
-        "repudiation": "requirement must support audit logging and traceability",
-        "denial of service": "requirement must protect availability and throttle excessive input"
-    }
-
-    reference = canonical_mitigation.get(threat_category.lower())
-    if not reference:
+    category = threat_category.lower()
+    if category not in CANONICAL_MITIGATIONS:
         return False
 
-    sim_score = util.cos_sim(model.encode(reference), model.encode(req_text))[0][0].item()
+    reference = get_reference_embeddings()[list(CANONICAL_MITIGATIONS).index(category)]
+    req_embedding = get_embedding_model().encode(req_text, convert_to_numpy=True, normalize_embeddings=True)
+    sim_score = float(np.dot(reference, req_embedding))
     return sim_score > 0.6
+
+class CategoryRelevanceIndex:
+    """
+    (requirement x STRIDE category) similarity matrix for a whole requirement
+    set, computed in one vectorized pass from the stored requirement
+    embeddings and cached next to them, keyed by the requirement-set
+    fingerprint. Per-threat category filtering is then a set lookup.
+    """
+
+    def __init__(self, requirements: list[dict], store: EmbeddingStore = None, threshold: float = 0.6):
+        self.requirements = requirements
+        self.threshold = threshold
+        store = store or EmbeddingStore()
+        embeddings = store.sync(requirements)
+
+        references_hash = hashlib.sha256("\n".join(CANONICAL_MITIGATIONS.values()).encode("utf-8")).hexdigest()
+        cache_path = os.path.join(store.directory, f"category_scores_{store.fingerprint[:16]}_{references_hash[:8]}.npy")
+        if os.path.exists(cache_path):
+            self.scores = np.load(cache_path)
+        else:
+            self.scores = np.asarray(embeddings, dtype=np.float32) @ get_reference_embeddings(store.model_name).T
+            for stale_path in glob.glob(os.path.join(store.directory, "category_scores_*.npy")):
+                os.remove(stale_path)
+            np.save(cache_path, self.scores)
+
+        self.relevant_ids = {
+            category: {requirements[i]["id"] for i in np.nonzero(self.scores[:, j] > threshold)[0]}
+            for j, category in enumerate(CANONICAL_MITIGATIONS)
+        }
+
+    def is_relevant(self, threat_category: str, req_id) -> bool:
+        return req_id in self.relevant_ids.get(threat_category.lower(), ())
+
+    def filter(self, threat_category: str, requirements: list[dict]) -> list[dict]:
+        """
+        Keep the requirements relevant to the threat's STRIDE category.
+        Threats with an unknown category are left unfiltered.
+        """
+        relevant = self.relevant_ids.get(str(threat_category).lower())
+        if relevant is None:
+            return requirements
+        return [r for r in requirements if r["id"] in relevant]
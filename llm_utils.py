@@ -1,14 +1,21 @@
 import os
+import asyncio
+import contextlib
+import concurrent.futures
 import requests
 from dotenv import load_dotenv
 import time
+import random
+import threading
+import email.utils
+import datetime
+import math
 import httpx
+import json
 import hashlib
-import shelve
 from llm_config import get_llm_config
-_llm_response_cache = {}
-
-CACHE_PATH = "llm_cache.db"  # Persistent cache on disk
+from llm_cache import get_cache, clear_cache
+from metrics import get_metrics
 
 # Load environment variables from .env file
 load_dotenv()
@@ -51,6 +58,162 @@ def hash_prompt(prompt: str, model: str) -> str:
     key_string = f"{model}:{prompt}"
     return hashlib.sha256(key_string.encode("utf-8")).hexdigest()
 
+DEFAULT_SYSTEM_PROMPT = "You are a cybersecurity expert mapping threats to requirements."
+
+def build_llm_request(prompt: str, config: dict, max_tokens=2048, temperature=0.0, system_prompt=None):
+    """
+    Build the (headers, payload) pair for a chat-completions request.
+    A static system_prompt lets providers reuse their prompt-prefix cache.
+    """
+    headers = config["headers"](config["api_key"]) if callable(config["headers"]) else config["headers"]
+
+    payload = {
+        "model": config["model"],
+        "messages": [
+            {"role": "system", "content": system_prompt or DEFAULT_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        "max_tokens": max_tokens,
+        "temperature": temperature
+    }
+    return headers, payload
+
+def response_cache_key(config: dict, prompt: str, system_prompt=None, temperature=0.0, max_tokens=2048) -> str:
+    """Key of a request in the persistent response cache."""
+    return get_cache().make_key(
+        config["provider"], config["model"], temperature, max_tokens, f"{system_prompt or ''}\x00{prompt}"
+    )
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+def get_router():
+    """The shared llm_router.LLMRouter when LLM_ROUTES lists several backends, else None."""
+    from llm_router import get_router as get_shared_router  # llm_router builds on this module
+    return get_shared_router()
+
+_http_clients = {}
+_http_clients_lock = threading.Lock()
+
+def _http2_enabled(config: dict) -> bool:
+    if not config.get("http2"):
+        return False
+    try:
+        import h2  # noqa: F401  (httpx needs the optional h2 package for HTTP/2)
+        return True
+    except ImportError:
+        return False
+
+def _client_kwargs(config: dict) -> dict:
+    limit = config.get("max_concurrency", 4)
+    return {
+        "timeout": config.get("timeout", 60),
+        "http2": _http2_enabled(config),
+        "limits": httpx.Limits(max_connections=limit, max_keepalive_connections=limit),
+    }
+
+def get_http_client(config: dict) -> httpx.Client:
+    """
+    Return the shared keep-alive client for a provider, creating it on first use.
+    """
+    with _http_clients_lock:
+        client = _http_clients.get(config["provider"])
+        if client is None:
+            client = httpx.Client(**_client_kwargs(config))
+            _http_clients[config["provider"]] = client
+        return client
+
+def make_async_client(config: dict, max_connections=None) -> httpx.AsyncClient:
+    """
+    Create an AsyncClient with the same pooling / HTTP/2 settings as get_http_client.
+    Async clients are tied to an event loop, so callers own and close them.
+    """
+    kwargs = _client_kwargs(config)
+    if max_connections:
+        kwargs["limits"] = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+    return httpx.AsyncClient(**kwargs)
+
+def retry_after_seconds(response, config: dict):
+    """
+    Seconds asked for by the response's Retry-After header (delta-seconds or
+    HTTP date, capped at backoff_max), or None when it is missing or malformed.
+    """
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if not retry_after:
+        return None
+    try:
+        seconds = float(retry_after)
+        if math.isfinite(seconds):
+            return min(max(0.0, seconds), config["backoff_max"])
+    except ValueError:
+        pass
+    try:
+        retry_date = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    if retry_date is None:
+        return None
+    if retry_date.tzinfo is None:
+        retry_date = retry_date.replace(tzinfo=datetime.timezone.utc)
+    return min(max(0.0, retry_date.timestamp() - time.time()), config["backoff_max"])
+
+def _retry_delay(attempt: int, config: dict, response=None) -> float:
+    """
+    Seconds to wait before the next attempt: the server's Retry-After if it
+    sent a valid one, otherwise exponential backoff with full jitter.
+    """
+    retry_after = retry_after_seconds(response, config)
+    if retry_after is not None:
+        return retry_after
+    backoff = min(config["backoff_max"], config["backoff_base"] * (2 ** attempt))
+    return random.uniform(0, backoff)
+
+def _post_with_retry(client: httpx.Client, config: dict, headers: dict, payload: dict) -> httpx.Response:
+    metrics = get_metrics()
+    for attempt in range(config["max_retries"] + 1):
+        response = None
+        if attempt:
+            metrics.incr("llm_retries")
+        started = time.perf_counter()
+        try:
+            response = client.post(config["url"], headers=headers, json=payload)
+            metrics.observe_attempt(config["provider"], config["model"], time.perf_counter() - started)
+            if response.status_code not in RETRY_STATUS_CODES:
+                response.raise_for_status()
+                return response
+        except httpx.TransportError:
+            if attempt == config["max_retries"]:
+                raise
+        if attempt == config["max_retries"]:
+            response.raise_for_status()
+        time.sleep(_retry_delay(attempt, config, response))
+
+async def _post_with_retry_async(client: httpx.AsyncClient, config: dict, headers: dict, payload: dict,
+                                 semaphore: asyncio.Semaphore = None) -> httpx.Response:
+    # The semaphore is only held while a request is in flight, not while backing off
+    metrics = get_metrics()
+    for attempt in range(config["max_retries"] + 1):
+        response = None
+        if attempt:
+            metrics.incr("llm_retries")
+        try:
+            if semaphore is None:
+                started = time.perf_counter()
+                response = await client.post(config["url"], headers=headers, json=payload)
+            else:
+                async with semaphore:
+                    started = time.perf_counter()
+                    response = await client.post(config["url"], headers=headers, json=payload)
+            metrics.observe_attempt(config["provider"], config["model"], time.perf_counter() - started)
+            if response.status_code not in RETRY_STATUS_CODES:
+                response.raise_for_status()
+                return response
+        except httpx.TransportError:
+            if attempt == config["max_retries"]:
+                raise
+        if attempt == config["max_retries"]:
+            response.raise_for_status()
+        await asyncio.sleep(_retry_delay(attempt, config, response))
+
 def call_llm(
     prompt: str,
     provider=None,
@@ -59,40 +222,124 @@ def call_llm(
     max_tokens=2048,
     temperature=0.0,
     print_logs=False,
-    use_cache=False
+    use_cache=False,
+    system_prompt=None,
+    cacheable=None
 ) -> str:
+    """
+    Send a prompt to the configured provider over its pooled keep-alive client.
+    429/5xx responses and transport errors are retried with exponential
+    backoff (honouring Retry-After) before an "[LLM ERROR]" string is returned.
+    With LLM_ROUTES set (and no explicit provider/model/key), requests go
+    through llm_router instead and fail over between the listed backends.
+    With use_cache, `cacheable(response)` (if given) decides which answers
+    are stored, so prose, truncated JSON or refusals aren't replayed for the
+    cache's whole TTL; cached answers it rejects are asked again.
+    """
+    try:
+        router = get_router() if provider is None and model is None and api_key is None else None
+    except ValueError as e:  # LLM_ROUTES without any usable backend
+        get_metrics().incr("llm_errors")
+        return f"[LLM ERROR] {e}"
     config = get_llm_config(provider, model, api_key)
 
-    if not config.get("api_key"):
+    if router is None and not config.get("api_key"):
         return f"[LLM ERROR] Missing API key for provider: {config['provider']}"
 
-    headers = config["headers"](config["api_key"]) if callable(config["headers"]) else config["headers"]
+    headers, payload = build_llm_request(prompt, config, max_tokens, temperature, system_prompt)
 
-    # Hash prompt to use as cache key
-    cache_key = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    cache_key = response_cache_key(router.cache_config if router else config, prompt, system_prompt,
+                                   temperature, max_tokens)
+
+    if use_cache:
+        cached = get_cache().get(cache_key)
+        if cached is not None and cacheable is not None and not cacheable(cached):
+            cached = None  # stored before the caller checked answers; ask again
+        get_metrics().incr("cache_misses" if cached is None else "cache_hits")
+        if cached is not None:
+            if print_logs:
+                print("🧠 Using cached response")
+            return cached
+
+    metrics = get_metrics()
+    try:
+        if router is not None:
+            config, body = router.call(prompt, max_tokens, temperature, system_prompt)
+        else:
+            body = _post_with_retry(get_http_client(config), config, headers, payload).json()
+        result = body["choices"][0]["message"]["content"].strip()
+        metrics.observe_llm(config["provider"], config["model"], body.get("usage"))
+
+        if use_cache and (cacheable is None or cacheable(result)):
+            get_cache().set(cache_key, result)
 
-    if use_cache and cache_key in _llm_response_cache:
         if print_logs:
-            print("🧠 Using cached response")
-        return _llm_response_cache[cache_key]
+            print("🔍 Raw LLM response:\n", result)
 
-    payload = {
-        "model": config["model"],
-        "messages": [
-            {"role": "system", "content": "You are a cybersecurity expert mapping threats to requirements."},
-            {"role": "user", "content": prompt}
-        ],
-        "max_tokens": max_tokens,
-        "temperature": temperature
-    }
+        return result
+
+    except Exception as e:
+        metrics.observe_llm(config["provider"], config["model"], error=True)
+        metrics.incr("llm_errors")
+        return f"[LLM ERROR] {str(e)}"
 
+async def call_llm_async(
+    prompt: str,
+    client: httpx.AsyncClient,
+    semaphore: asyncio.Semaphore = None,
+    provider=None,
+    model=None,
+    api_key=None,
+    max_tokens=2048,
+    temperature=0.0,
+    print_logs=False,
+    use_cache=False,
+    system_prompt=None,
+    cacheable=None
+) -> str:
+    """
+    Async counterpart of call_llm. The semaphore bounds how many requests
+    are in flight at once; the client is shared so connections are reused.
+    429/5xx responses and transport errors are retried like in call_llm, and
+    LLM_ROUTES routes (and optionally hedges) requests the same way, and
+    `cacheable` filters what is cached.
+    """
     try:
-        response = httpx.post(config["url"], headers=headers, json=payload, timeout=60)
-        response.raise_for_status()
-        result = response.json()["choices"][0]["message"]["content"].strip()
+        router = get_router() if provider is None and model is None and api_key is None else None
+    except ValueError as e:  # LLM_ROUTES without any usable backend
+        get_metrics().incr("llm_errors")
+        return f"[LLM ERROR] {e}"
+    config = get_llm_config(provider, model, api_key)
+
+    if router is None and not config.get("api_key"):
+        return f"[LLM ERROR] Missing API key for provider: {config['provider']}"
 
-        if use_cache:
-            _llm_response_cache[cache_key] = result
+    headers, payload = build_llm_request(prompt, config, max_tokens, temperature, system_prompt)
+
+    cache_key = response_cache_key(router.cache_config if router else config, prompt, system_prompt,
+                                   temperature, max_tokens)
+
+    if use_cache:
+        cached = get_cache().get(cache_key)
+        if cached is not None and cacheable is not None and not cacheable(cached):
+            cached = None  # stored before the caller checked answers; ask again
+        get_metrics().incr("cache_misses" if cached is None else "cache_hits")
+        if cached is not None:
+            if print_logs:
+                print("🧠 Using cached response")
+            return cached
+
+    metrics = get_metrics()
+    try:
+        if router is not None:
+            config, body = await router.call_async(prompt, client, semaphore, max_tokens, temperature, system_prompt)
+        else:
+            body = (await _post_with_retry_async(client, config, headers, payload, semaphore)).json()
+        result = body["choices"][0]["message"]["content"].strip()
+        metrics.observe_llm(config["provider"], config["model"], body.get("usage"))
+
+        if use_cache and (cacheable is None or cacheable(result)):
+            get_cache().set(cache_key, result)
 
         if print_logs:
             print("🔍 Raw LLM response:\n", result)
@@ -100,8 +347,98 @@ def call_llm(
         return result
 
     except Exception as e:
+        metrics.observe_llm(config["provider"], config["model"], error=True)
+        metrics.incr("llm_errors")
         return f"[LLM ERROR] {str(e)}"
 
+async def stream_llm_async(
+    prompt: str,
+    client: httpx.AsyncClient,
+    semaphore: asyncio.Semaphore = None,
+    provider=None,
+    model=None,
+    api_key=None,
+    max_tokens=2048,
+    temperature=0.0,
+    system_prompt=None
+):
+    """
+    Async generator over the content deltas of a streamed (SSE) completion.
+
+    Opening the stream is retried on 429/5xx and transport errors like
+    call_llm_async; errors after the first byte propagate to the caller.
+    Closing the generator early (e.g. to cut off a runaway answer) closes
+    the connection, so the provider stops generating.
+    """
+    config = get_llm_config(provider, model, api_key)
+    if not config.get("api_key"):
+        raise RuntimeError(f"Missing API key for provider: {config['provider']}")
+
+    headers, payload = build_llm_request(prompt, config, max_tokens, temperature, system_prompt)
+    payload["stream"] = True
+    if config["provider"] == "openai":
+        payload["stream_options"] = {"include_usage": True}
+
+    metrics = get_metrics()
+    streaming = False
+    for attempt in range(config["max_retries"] + 1):
+        if attempt:
+            metrics.incr("llm_retries")
+        response = None
+        try:
+            async with contextlib.AsyncExitStack() as stack:
+                if semaphore is not None:
+                    await stack.enter_async_context(semaphore)
+                started = time.perf_counter()
+                response = await stack.enter_async_context(
+                    client.stream("POST", config["url"], headers=headers, json=payload)
+                )
+                if response.status_code in RETRY_STATUS_CODES and attempt < config["max_retries"]:
+                    await response.aread()
+                else:
+                    response.raise_for_status()
+                    streaming = True
+                    usage = None
+                    try:
+                        async for line in response.aiter_lines():
+                            if not line.startswith("data:"):
+                                continue
+                            data = line[len("data:"):].strip()
+                            if data == "[DONE]":
+                                break
+                            event = json.loads(data)
+                            usage = event.get("usage") or usage
+                            for choice in event.get("choices") or []:
+                                delta = (choice.get("delta") or {}).get("content")
+                                if delta:
+                                    yield delta
+                    finally:
+                        metrics.observe_attempt(config["provider"], config["model"], time.perf_counter() - started)
+                        metrics.observe_llm(config["provider"], config["model"], usage)
+                    return
+        except httpx.TransportError:
+            # Deltas already handed out can't be taken back: only retry before the stream started
+            if streaming or attempt == config["max_retries"]:
+                raise
+        await asyncio.sleep(_retry_delay(attempt, config, response))
+
+def run_async(coro):
+    """
+    Run a coroutine to completion from synchronous code (CLI or Streamlit).
+    Falls back to a helper thread when an event loop is already running.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(asyncio.run, coro).result()
+
 def clear_cache_file():
-    if os.path.exists(".cache/llm_cache.json"):
-        os.remove(".cache/llm_cache.json")
+    """Delete the persistent LLM response cache."""
+    clear_cache()
+
+def get_cache_stats() -> dict:
+    """Hit/miss counters and entry count of the persistent LLM response cache."""
+    return get_cache().stats()
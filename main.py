@@ -1,11 +1,59 @@
+import os
+import argparse
 
-def main():
-    print("🚀 Starting the tool...Please wait, importing packages takes time", flush=True)
+def parse_args(argv=None):
+    from sharding import parse_shard
+
+    def shard_spec(value):
+        try:
+            return parse_shard(value)
+        except ValueError as e:
+            raise argparse.ArgumentTypeError(str(e))
+
+    parser = argparse.ArgumentParser(description="Map threats to mitigating requirements via LLM.")
+    parser.add_argument("--full", action="store_true",
+                        help="ignore the previous run's results and re-map every threat")
+    parser.add_argument("--dedupe", action="store_true",
+                        help="map one representative per cluster of duplicate threats and copy its mitigations")
+    parser.add_argument("--dedupe-threshold", type=float, metavar="SIM",
+                        help="with --dedupe, also cluster threats whose texts have at least this "
+                             "embedding similarity (e.g. 0.95)")
+    parser.add_argument("--cascade", action="store_true",
+                        help="screen candidates with a cheap model first (LLM_SCREEN_MODEL) and only send "
+                             "the ones that pass to the main model for justification")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--shard", type=shard_spec, metavar="I/N",
+                      help="only map shard I of N (1-based) and write it to its own partial output")
+    mode.add_argument("--merge", action="store_true",
+                      help="combine the shard outputs into the output file, in the threat file's order")
+    mode.add_argument("--workers", type=int, metavar="N",
+                      help="run N shards as parallel processes on this machine, then merge them; "
+                           "set LLM_API_KEYS (comma-separated) to give each worker its own key")
+    return parser.parse_args(argv)
+
+def write_metrics(metrics, output_file):
+    """JSON run report and Prometheus textfile next to the output file."""
+    metrics.write_json(f"{output_file}.metrics.json")
+    metrics.write_prometheus(f"{output_file}.metrics.prom")
+    report = metrics.report()
+    tokens = sum(m["prompt_tokens"] + m["completion_tokens"] for m in report["llm"].values())
+    print(f"📊 Run took {report['run_seconds']:.1f}s, {tokens} LLM tokens; "
+          f"metrics written to {output_file}.metrics.json / .prom")
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.merge or args.workers:
+        return run_sharded(args)
+    print("🚀 Starting the tool...", flush=True)
     from data_loader import read_threats, read_requirements
     from system_summary import get_system_summary
     # from rmp_loader import extract_rmp_context
-    from threat_processor import process_threats
-    from result_writer import save_updated_threats
+    from threat_processor import stream_threats
+    from result_writer import StreamingResultWriter
+    from llm_utils import get_cache_stats, get_router
+    from run_journal import RunJournal
+    from run_manifest import RunManifest
+    from metrics import get_metrics
     from file_paths import (
         get_threat_file,
         get_requirements_file,
@@ -20,9 +68,32 @@ def main():
     rmp_file = get_rmp_file()
     output_file = get_output_file()
 
+    metrics = get_metrics()
+
+    if args.dedupe_threshold is not None:
+        # Embedding dedupe needs the sentence-transformers model: load it while the workbooks are read
+        from model_registry import warm_up
+        warm_up()
+
+    try:
+        router = get_router()
+    except ValueError as e:
+        print(f"❌ {e}: set the API keys of the listed providers, or unset LLM_ROUTES")
+        raise SystemExit(1)
+
     # Load threats and requirements
-    threats_df = read_threats(threat_file)
-    requirements = read_requirements(requirements_file)
+    with metrics.stage("load"):
+        threats_df = read_threats(threat_file)
+        requirements = read_requirements(requirements_file)
+
+    if args.shard:
+        from sharding import select_shard, shard_output_path
+
+        index, count = args.shard
+        total = len(threats_df)
+        threats_df = select_shard(threats_df, index, count)
+        output_file = shard_output_path(output_file, index, count)
+        print(f"🧩 Shard {index}/{count}: {len(threats_df)} of {total} threats → {output_file}")
 
     # Load system and RMP context
     system_summary = get_system_summary()
@@ -31,13 +102,84 @@ def main():
 
     req_structure_hint = get_requirement_format_description()
 
+    # Completed chunks are journaled so an interrupted run can resume where it stopped
+    journal = RunJournal(f"{output_file}.journal.jsonl")
+    if len(journal):
+        print(f"♻️ Resuming: {len(journal)} completed chunks found in {journal.path}")
+
+    # Hashes of the last completed run: only changed threats/requirements are re-mapped
+    manifest = RunManifest(f"{output_file}.manifest.json", rmp_context, req_structure_hint, full=args.full)
+    if len(manifest):
+        print(f"♻️ Incremental run against {len(manifest)} threats from the previous run "
+              f"(use --full to re-map everything)")
+
     print("🔹 Matching threats to requirements via LLM...")
-    processed_df = process_threats(
-        threats_df, requirements, system_summary, rmp_context, req_structure_hint
-    )
+    # Rows are written as soon as each threat is done (in threat order)
+    try:
+        with StreamingResultWriter(output_file) as writer:
+            for position, row in stream_threats(
+                threats_df, requirements, system_summary, rmp_context, req_structure_hint,
+                journal=journal, manifest=manifest,
+                dedupe=args.dedupe or args.dedupe_threshold is not None, dedupe_threshold=args.dedupe_threshold,
+                cascade=args.cascade
+            ):
+                writer.write(row)
+                print(f"🔹 {position + 1}/{len(threats_df)} threats mapped", flush=True)
+    except BaseException:
+        journal.close()
+        write_metrics(metrics, output_file)
+        print(f"⚠️ Run interrupted; {journal.recorded} new chunks saved to {journal.path}. "
+              f"Re-run with the same inputs to resume.")
+        raise
+
+    print(f"♻️ {journal.resumed} chunks reused from the journal, {journal.recorded} sent to the LLM")
+    journal.remove()
+    print(f"♻️ {manifest.reused} threats unchanged, {manifest.partial} partially and "
+          f"{manifest.remapped} fully re-mapped")
+    manifest.save()
+
+    stats = get_cache_stats()
+    print(f"💾 LLM cache: {stats['hits']} hits, {stats['misses']} misses "
+          f"({stats['hit_rate']:.0%} hit rate, {stats['entries']} entries stored)")
+    if router is not None:
+        for name, backend in router.report()["backends"].items():
+            print(f"🔀 {name}: p50 {backend['p50_s'] or 0:.2f}s, p95 {backend['p95_s'] or 0:.2f}s, "
+                  f"{backend['error_rate']:.0%} errors")
+        print(f"🔀 {router.hedges} hedged requests ({router.hedge_wins} won by the hedge), "
+              f"{router.failovers} failovers")
+    write_metrics(metrics, output_file)
+
+def run_sharded(args):
+    """--workers: run every shard locally in parallel, then merge; --merge: merge only."""
+    from sharding import run_local_shards, merge_shards
+    from data_loader import read_threats
+    from file_paths import get_output_file, get_threat_file
+
+    output_file = get_output_file()
+    if args.workers:
+        api_keys = [k.strip() for k in os.getenv("LLM_API_KEYS", "").split(",") if k.strip()]
+        extra_args = ["--full"] if args.full else []
+        if args.dedupe:
+            extra_args.append("--dedupe")
+        if args.dedupe_threshold is not None:
+            extra_args += ["--dedupe-threshold", str(args.dedupe_threshold)]
+        if args.cascade:
+            extra_args.append("--cascade")
+        exit_codes = run_local_shards(args.workers, extra_args, api_keys)
+        failed = [i + 1 for i, code in enumerate(exit_codes) if code != 0]
+        if failed:
+            print(f"❌ Shards {failed} failed; re-run them with --shard i/{args.workers} "
+                  f"(they resume from their journals), then --merge")
+            raise SystemExit(1)
 
-    # Write result
-    save_updated_threats(processed_df, output_file)
+    threat_count = len(read_threats(get_threat_file()))
+    try:
+        rows = merge_shards(output_file, threat_count)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"❌ {e}; {output_file} was left unchanged. Re-run the incomplete shards with "
+              f"--shard i/n (they resume from their journals), then --merge")
+        raise SystemExit(1)
+    print(f"🧩 Merged {rows} threats into {output_file}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,204 @@
+import os
+import json
+import time
+import tempfile
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the LLM latency histogram buckets
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+
+PROMETHEUS_PREFIX = "threatmapper"
+
+class RunMetrics:
+    """
+    Per-run counters for where time and tokens go.
+
+    - stages: summed seconds and call count per stage (load, asset_extraction,
+      filtering, dedup, prompt_build, token_count, llm_call, parse, write). Stages
+      that run concurrently (llm_call) can add up to more than the run time.
+    - llm: per provider/model request and error counts, prompt/completion
+      tokens from the response's `usage` field and a histogram of HTTP
+      attempt latency (time in flight; queueing and backoff excluded).
+    - events: plain counters such as cache_hits, cache_misses, journal_hits,
+      parse_failures, llm_errors, llm_retries, llm_failovers, llm_hedges,
+      llm_hedge_wins, dedup_threats and dedup_calls_saved.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.stages = {}
+            self.llm = {}
+            self.events = {}
+
+    def add_stage_time(self, stage: str, seconds: float, count: int = 1):
+        with self._lock:
+            entry = self.stages.setdefault(stage, {"seconds": 0.0, "count": 0})
+            entry["seconds"] += seconds
+            entry["count"] += count
+
+    @contextmanager
+    def stage(self, stage: str):
+        """Time the enclosed block as one call of `stage`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage_time(stage, time.perf_counter() - start)
+
+    def incr(self, event: str, n: int = 1):
+        with self._lock:
+            self.events[event] = self.events.get(event, 0) + n
+
+    def _llm_entry(self, provider, model) -> dict:
+        return self.llm.setdefault(f"{provider}/{model}", {
+            "provider": provider,
+            "model": model,
+            "requests": 0,
+            "errors": 0,
+            "attempts": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "latency_sum": 0.0,
+            "latency_buckets": [0] * len(LATENCY_BUCKETS),
+        })
+
+    def observe_llm(self, provider, model, usage=None, error=False):
+        """Record one LLM request (after retries) and its token usage, if reported."""
+        usage = usage or {}
+        with self._lock:
+            entry = self._llm_entry(provider, model)
+            entry["requests"] += 1
+            entry["errors"] += int(error)
+            entry["prompt_tokens"] += usage.get("prompt_tokens") or 0
+            entry["completion_tokens"] += usage.get("completion_tokens") or 0
+
+    def observe_attempt(self, provider, model, latency: float):
+        """Record the time one HTTP attempt was in flight."""
+        self.add_stage_time("llm_call", latency)
+        with self._lock:
+            entry = self._llm_entry(provider, model)
+            entry["attempts"] += 1
+            entry["latency_sum"] += latency
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if latency <= bound:
+                    entry["latency_buckets"][i] += 1
+                    break
+
+    def report(self) -> dict:
+        """JSON-serialisable summary of the run so far."""
+        with self._lock:
+            hits = self.events.get("cache_hits", 0)
+            misses = self.events.get("cache_misses", 0)
+            llm = {}
+            for key, entry in self.llm.items():
+                llm[key] = {
+                    **{k: v for k, v in entry.items() if k != "latency_buckets"},
+                    "latency_avg": entry["latency_sum"] / entry["attempts"] if entry["attempts"] else 0.0,
+                    "latency_histogram": {
+                        f"le_{bound}": count for bound, count in zip(LATENCY_BUCKETS, entry["latency_buckets"])
+                    },
+                }
+            return {
+                "started": self.started,
+                "run_seconds": time.time() - self.started,
+                "stages": {stage: dict(entry) for stage, entry in self.stages.items()},
+                "llm": llm,
+                "events": dict(self.events),
+                "cache_hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            }
+
+    def write_json(self, path: str):
+        _atomic_write(path, json.dumps(self.report(), indent=2))
+
+    def prometheus_text(self) -> str:
+        """The run's metrics in Prometheus text exposition format (node_exporter textfile style)."""
+        report = self.report()
+        p = PROMETHEUS_PREFIX
+        lines = [
+            f"# HELP {p}_run_seconds Wall time of the run.",
+            f"# TYPE {p}_run_seconds gauge",
+            f"{p}_run_seconds {report['run_seconds']:.6f}",
+            f"# HELP {p}_stage_seconds_total Seconds spent per stage (summed over concurrent calls).",
+            f"# TYPE {p}_stage_seconds_total counter",
+        ]
+        lines += [f'{p}_stage_seconds_total{{stage="{_label(s)}"}} {e["seconds"]:.6f}' for s, e in report["stages"].items()]
+        lines += [f"# HELP {p}_stage_calls_total Calls per stage.", f"# TYPE {p}_stage_calls_total counter"]
+        lines += [f'{p}_stage_calls_total{{stage="{_label(s)}"}} {e["count"]}' for s, e in report["stages"].items()]
+
+        with self._lock:
+            llm_entries = [dict(e, latency_buckets=list(e["latency_buckets"])) for e in self.llm.values()]
+        labels = [f'provider="{_label(e["provider"])}",model="{_label(e["model"])}"' for e in llm_entries]
+
+        lines += [f"# HELP {p}_llm_requests_total LLM requests (after retries).",
+                  f"# TYPE {p}_llm_requests_total counter"]
+        lines += [f"{p}_llm_requests_total{{{l}}} {e['requests']}" for l, e in zip(labels, llm_entries)]
+        lines += [f"# HELP {p}_llm_errors_total LLM requests that failed.",
+                  f"# TYPE {p}_llm_errors_total counter"]
+        lines += [f"{p}_llm_errors_total{{{l}}} {e['errors']}" for l, e in zip(labels, llm_entries)]
+        lines += [f"# HELP {p}_llm_tokens_total Tokens reported by the provider.",
+                  f"# TYPE {p}_llm_tokens_total counter"]
+        for l, e in zip(labels, llm_entries):
+            lines.append(f'{p}_llm_tokens_total{{{l},type="prompt"}} {e["prompt_tokens"]}')
+            lines.append(f'{p}_llm_tokens_total{{{l},type="completion"}} {e["completion_tokens"]}')
+        lines += [f"# HELP {p}_llm_latency_seconds Time LLM HTTP attempts were in flight.",
+                  f"# TYPE {p}_llm_latency_seconds histogram"]
+        for l, e in zip(labels, llm_entries):
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, e["latency_buckets"]):
+                cumulative += count
+                lines.append(f'{p}_llm_latency_seconds_bucket{{{l},le="{bound}"}} {cumulative}')
+            lines.append(f'{p}_llm_latency_seconds_bucket{{{l},le="+Inf"}} {e["attempts"]}')
+            lines.append(f"{p}_llm_latency_seconds_sum{{{l}}} {e['latency_sum']:.6f}")
+            lines.append(f"{p}_llm_latency_seconds_count{{{l}}} {e['attempts']}")
+
+        lines += [f"# HELP {p}_events_total Run events (cache hits/misses, parse failures, ...).",
+                  f"# TYPE {p}_events_total counter"]
+        lines += [f'{p}_events_total{{event="{_label(e)}"}} {n}' for e, n in report["events"].items()]
+        lines += [f"# HELP {p}_cache_hit_ratio LLM response cache hit ratio.",
+                  f"# TYPE {p}_cache_hit_ratio gauge",
+                  f"{p}_cache_hit_ratio {report['cache_hit_rate']:.6f}"]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str):
+        _atomic_write(path, self.prometheus_text())
+
+def _label(value) -> str:
+    """A label value escaped for the Prometheus text format."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _atomic_write(path: str, text: str):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    # A temp file of our own, so concurrent writers can't replace each other's half-written file
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.chmod(tmp, 0o644)  # mkstemp files are private; scrapers (e.g. a textfile collector) need to read it
+    os.replace(tmp, path)
+
+_metrics = RunMetrics()
+_scoped = contextvars.ContextVar("run_metrics", default=None)
+
+def get_metrics() -> RunMetrics:
+    """
+    The metrics of the current run: the ones installed by use_metrics, else
+    the process-wide ones (reset() between runs).
+    """
+    metrics = _scoped.get()
+    return _metrics if metrics is None else metrics
+
+@contextmanager
+def use_metrics(metrics: RunMetrics):
+    """Collect into `metrics` inside the block (and the asyncio tasks it starts), e.g. one per Streamlit job."""
+    token = _scoped.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _scoped.reset(token)
@@ -0,0 +1,49 @@
+import threading
+
+DEFAULT_EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+_models = {}
+_lock = threading.Lock()
+
+def _get_or_load(key, loader):
+    model = _models.get(key)
+    if model is None:
+        with _lock:
+            model = _models.get(key)
+            if model is None:
+                model = loader()
+                _models[key] = model
+    return model
+
+def get_embedding_model(name: str = DEFAULT_EMBEDDING_MODEL):
+    """
+    Return the shared SentenceTransformer for `name`, loading it on first use.
+    sentence_transformers (and torch) are only imported at that point.
+    """
+    def load():
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(name)
+    return _get_or_load(("embedding", name), load)
+
+def get_hf_tokenizer(name: str):
+    """Return the shared Hugging Face tokenizer for `name`, loading it on first use."""
+    def load():
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(name)
+    return _get_or_load(("tokenizer", name), load)
+
+def warm_up(embedding_models=(DEFAULT_EMBEDDING_MODEL,), background=True):
+    """
+    Pre-load models so the first stage that needs them doesn't pay the cost.
+    With background=True the loading happens in a daemon thread.
+    """
+    def load_all():
+        for name in embedding_models:
+            get_embedding_model(name)
+
+    if not background:
+        load_all()
+        return None
+    thread = threading.Thread(target=load_all, daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,215 @@
+import yaml
+from llm_threat_mapper import get_asset_matcher
+
+SYSTEM_ROLE = "You are a cybersecurity expert mapping threats to requirements."
+
+SINGLE_THREAT_INSTRUCTIONS = """
+You are given two YAML blocks: one called `Threat`, and one called `CandidateRequirements`.
+
+Your job is to:
+- ONLY include requirements that **explicitly and functionally** mitigate the described threat.
+- Consider that all CandidateRequirements are already **filtered by asset relevance**: the assets they are allocated to are listed just before the `CandidateRequirements` block.
+- Match requirements **based on semantic alignment** with the threat **Category** (e.g., Elevation Of Privilege, Information Disclosure, etc.)
+- Explain how the requirement mitigates the threat **in function**, not just keyword overlap.
+
+Output format MUST be in JSON. The JSON should be an object with a single key "mitigations", whose value is a list of objects. Each object in this list MUST have the following keys:
+- "requirement": (string) — a single requirement ID such as "[AVP_PCyA_2099]"
+- "justification": (string) — an explanation of how this requirement mitigates the given threat.
+
+If, and only if, NO requirements are found that effectively mitigate the given threat, the "mitigations" list SHOULD be empty. DO NOT return "None", "Not Applicable", or similar strings within the list items if no mitigations are found. Instead, return an empty list.
+
+Example expected JSON structure for mitigations found:
+{{
+  "mitigations": [
+    {{
+      "requirement": "[AVP_PCyA_2099]",
+      "justification": "TLS client authentication ensures only authorized entities (like Switch) are allowed to interact with vCenter."
+    }},
+    {{
+      "requirement": "[AVP_PCyA_2527]",
+      "justification": "RBAC restricts access based on predefined roles, limiting what impersonated users can do."
+    }}
+  ]
+}}
+
+Example expected JSON structure when NO mitigations are found:
+{{
+  "mitigations": []
+}}
+
+Requirement Metadata Notes:
+{rmp_context}
+
+Requirement Format Hint:
+{req_structure_hint}
+Very important instructions:
+- Your entire response MUST ONLY be a valid JSON block that strictly follows the structure below.
+- DO NOT explain your reasoning outside the JSON.
+- DO NOT write any introduction, summary, or commentary before or after the JSON.
+- DO NOT format the JSON as Markdown (no triple backticks).
+- Just respond with raw JSON.
+
+The required JSON structure is:
+
+{{
+  "mitigations": [
+    {{
+      "requirement": "[requirement_id]",
+      "justification": "Short but precise justification."
+    }}
+  ]
+}}
+
+If no requirement matches, return:
+
+{{
+  "mitigations": []
+}}
+"""
+
+MULTI_THREAT_INSTRUCTIONS = """
+You are given two YAML blocks: one called `Threats`, a list of threats, and one called `CandidateRequirements`.
+Evaluate EACH threat independently against the same CandidateRequirements.
+
+For each threat:
+- ONLY include requirements that **explicitly and functionally** mitigate that threat.
+- Consider that all CandidateRequirements are already **filtered by asset relevance**: the assets they are allocated to are listed just before the `CandidateRequirements` block.
+- Match requirements **based on semantic alignment** with the threat **Category** (e.g., Elevation Of Privilege, Information Disclosure, etc.)
+- Explain how the requirement mitigates the threat **in function**, not just keyword overlap.
+
+Output format MUST be in JSON. The JSON should be an object with a single key "threats", whose value is an object
+with one key per threat ID (exactly as given in the `Threats` block). Each value is a list of objects with the keys:
+- "requirement": (string) — a single requirement ID such as "[AVP_PCyA_2099]"
+- "justification": (string) — an explanation of how this requirement mitigates that threat.
+
+If NO requirements mitigate a threat, its list MUST be empty. Every threat ID MUST appear in the output.
+
+Example expected JSON structure:
+{{
+  "threats": {{
+    "12": [
+      {{
+        "requirement": "[AVP_PCyA_2099]",
+        "justification": "TLS client authentication ensures only authorized entities (like Switch) are allowed to interact with vCenter."
+      }}
+    ],
+    "13": []
+  }}
+}}
+
+Requirement Metadata Notes:
+{rmp_context}
+
+Requirement Format Hint:
+{req_structure_hint}
+Very important instructions:
+- Your entire response MUST ONLY be a valid JSON block that strictly follows the structure above.
+- DO NOT explain your reasoning outside the JSON.
+- DO NOT write any introduction, summary, or commentary before or after the JSON.
+- DO NOT format the JSON as Markdown (no triple backticks).
+- Just respond with raw JSON.
+"""
+
+SCREEN_INSTRUCTIONS = """
+You are given two YAML blocks: one called `Threat`, and one called `CandidateRequirements`.
+Screen each candidate: could it plausibly mitigate the threat, functionally and in line with the threat
+Category? When in doubt, keep it; a later review makes the final decision.
+
+Respond with raw JSON only, no Markdown and no commentary: an object with a single key "relevant" listing the
+IDs of the requirements you keep, exactly as written, e.g. {{"relevant": ["[AVP_PCyA_2099]"]}}.
+If none is relevant, return {{"relevant": []}}.
+"""
+
+def _threat_fields(threat: dict, id_as_str=False) -> dict:
+    return {
+        "ID": str(threat["Id"]) if id_as_str else threat["Id"],
+        "Title": threat["Title"],
+        "Category": threat["Category"],
+        "Interaction": threat["Interaction"],
+        "Description": threat["Description"]
+    }
+
+def _threat_key(threat: dict) -> tuple:
+    return tuple(str(threat.get(k, "")) for k in ("Id", "Title", "Category", "Interaction", "Description"))
+
+class PromptBuilder:
+    """
+    Builds (system, user) prompt pairs for one run.
+
+    The static instructions (including rmp_context and req_structure_hint)
+    are rendered once and sent as the system message, so they form an
+    identical prefix on every request that providers can cache. Each
+    threat block and each requirement's YAML fragment is rendered once and
+    reused across chunks and threats.
+    """
+
+    def __init__(self, rmp_context, req_structure_hint, asset_list=None):
+        self.asset_list = asset_list
+        self.asset_matcher = get_asset_matcher(asset_list)
+        context = {"rmp_context": rmp_context, "req_structure_hint": req_structure_hint}
+        self.system_prompt = f"{SYSTEM_ROLE}\n\n{SINGLE_THREAT_INSTRUCTIONS.format(**context).strip()}"
+        self.batch_system_prompt = f"{SYSTEM_ROLE}\n\n{MULTI_THREAT_INSTRUCTIONS.format(**context).strip()}"
+        self.screen_system_prompt = f"{SYSTEM_ROLE}\n\n{SCREEN_INSTRUCTIONS.format().strip()}"
+        self._threat_blocks = {}
+        self._requirement_blocks = {}
+
+    def _asset_line(self, threats) -> str:
+        assets = []
+        for threat in threats:
+            for asset in self.asset_matcher.extract(threat.get("Interaction", "")):
+                if asset not in assets:
+                    assets.append(asset)
+        return f"CandidateRequirements are allocated to these assets → {', '.join(assets)}"
+
+    def threat_block(self, threat: dict) -> str:
+        key = _threat_key(threat)
+        block = self._threat_blocks.get(key)
+        if block is None:
+            threat_yaml = yaml.dump(_threat_fields(threat), default_flow_style=False)
+            block = f"Threat:\n{threat_yaml}\n{self._asset_line([threat])}\n\nCandidateRequirements:\n"
+            self._threat_blocks[key] = block
+        return block
+
+    def threats_block(self, threats: list) -> str:
+        key = tuple(_threat_key(t) for t in threats)
+        block = self._threat_blocks.get(key)
+        if block is None:
+            threats_yaml = yaml.dump([_threat_fields(t, id_as_str=True) for t in threats], default_flow_style=False)
+            block = f"Threats:\n{threats_yaml}\n{self._asset_line(threats)}\n\nCandidateRequirements:\n"
+            self._threat_blocks[key] = block
+        return block
+
+    def requirement_block(self, req: dict) -> str:
+        key = (str(req["id"]), str(req["text"]))
+        block = self._requirement_blocks.get(key)
+        if block is None:
+            block = yaml.dump([{"ID": req["id"], "Text": req["text"]}], default_flow_style=False)
+            self._requirement_blocks[key] = block
+        return block
+
+    def _requirements_yaml(self, requirements) -> str:
+        if not requirements:
+            return "[]\n"
+        return "".join(self.requirement_block(r) for r in requirements)
+
+    def build(self, threat: dict, requirements: list) -> tuple:
+        """(system, user) messages for one threat and a chunk of candidate requirements."""
+        return self.system_prompt, (self.threat_block(threat) + self._requirements_yaml(requirements)).strip()
+
+    def build_screen(self, threat: dict, requirements: list) -> tuple:
+        """(system, user) messages for the cascade's yes/no screen of a chunk of candidates."""
+        return self.screen_system_prompt, (self.threat_block(threat) + self._requirements_yaml(requirements)).strip()
+
+    def build_batch(self, threats: list, requirements: list) -> tuple:
+        """(system, user) messages for several threats sharing the same candidates."""
+        return self.batch_system_prompt, (self.threats_block(threats) + self._requirements_yaml(requirements)).strip()
+
+_builders = {}
+
+def get_prompt_builder(rmp_context, req_structure_hint, asset_list=None) -> PromptBuilder:
+    """Return the builder for this run's static context, compiling it on first use."""
+    key = (rmp_context, req_structure_hint, tuple(asset_list) if asset_list is not None else None)
+    builder = _builders.get(key)
+    if builder is None:
+        builder = _builders.setdefault(key, PromptBuilder(rmp_context, req_structure_hint, asset_list))
+    return builder
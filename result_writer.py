@@ -1,4 +1,8 @@
+import os
+import csv
+import json
 import pandas as pd
+from metrics import get_metrics
 
 def save_updated_threats(threats_df: pd.DataFrame, output_path: str):
     """
@@ -10,3 +14,118 @@ def save_updated_threats(threats_df: pd.DataFrame, output_path: str):
     """
     threats_df.to_excel(output_path, index=False)
     print(f"✅ Results saved to: {output_path}")
+
+def _cell(value):
+    # NaN / None become empty cells; everything else is written as-is
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    return value
+
+class JsonlResultWriter:
+    """Appends one JSON object per enriched threat; each line is flushed as it arrives."""
+
+    def __init__(self, output_path: str):
+        self.output_path = output_path
+        self._file = open(output_path, "w", encoding="utf-8")
+
+    def write(self, row: dict):
+        self._file.write(json.dumps({k: _cell(v) for k, v in row.items()}, default=str) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+class CsvResultWriter:
+    """Appends rows to a CSV file; the header comes from the first row written."""
+
+    def __init__(self, output_path: str):
+        self.output_path = output_path
+        self._file = open(output_path, "w", encoding="utf-8", newline="")
+        self._writer = None
+
+    def write(self, row: dict):
+        if self._writer is None:
+            self._writer = csv.DictWriter(self._file, fieldnames=list(row), extrasaction="ignore")
+            self._writer.writeheader()
+        self._writer.writerow({k: _cell(v) for k, v in row.items()})
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+class ExcelResultWriter:
+    """
+    Streams rows into a write-only openpyxl workbook, which keeps memory flat.
+    The .xlsx is only readable once close() has saved it; use CSV or JSONL
+    output to inspect partial results during a run.
+    """
+
+    def __init__(self, output_path: str):
+        from openpyxl import Workbook
+
+        self.output_path = output_path
+        self._workbook = Workbook(write_only=True)
+        self._sheet = self._workbook.create_sheet()
+        self._columns = None
+
+    def write(self, row: dict):
+        if self._columns is None:
+            self._columns = list(row)
+            self._sheet.append(self._columns)
+        self._sheet.append([_cell(row.get(column)) for column in self._columns])
+
+    def close(self):
+        self._workbook.save(self.output_path)
+
+def read_results(path: str) -> list[dict]:
+    """
+    Rows of a result file written by StreamingResultWriter (.xlsx, .csv or .jsonl).
+    "None" in the mitigation columns stays a string; empty cells become NaN.
+    A file without rows (e.g. from a shard that got no threats) gives [].
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".jsonl":
+        with open(path, "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+    if extension == ".csv":
+        # The header comes from the first row, so a CSV without rows is an empty file
+        if os.path.getsize(path) == 0:
+            return []
+        df = pd.read_csv(path, keep_default_na=False, na_values=[""])
+    else:
+        df = pd.read_excel(path, keep_default_na=False, na_values=[""], engine="openpyxl")
+    return df.to_dict("records")
+
+class StreamingResultWriter:
+    """
+    Context manager that writes enriched threats as they arrive, picking the
+    format from the output file extension (.xlsx, .csv or .jsonl).
+    """
+
+    WRITERS = {
+        ".xlsx": ExcelResultWriter,
+        ".csv": CsvResultWriter,
+        ".jsonl": JsonlResultWriter,
+    }
+
+    def __init__(self, output_path: str):
+        extension = os.path.splitext(output_path)[1].lower()
+        if extension not in self.WRITERS:
+            raise ValueError(f"Unsupported output format: {extension} (use .xlsx, .csv or .jsonl)")
+        self.output_path = output_path
+        self.rows_written = 0
+        self._writer = self.WRITERS[extension](output_path)
+
+    def write(self, row: dict):
+        with get_metrics().stage("write"):
+            self._writer.write(row)
+        self.rows_written += 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        with get_metrics().stage("write"):
+            self._writer.close()
+        print(f"✅ {self.rows_written} results saved to: {self.output_path}")
+        return False
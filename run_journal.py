@@ -0,0 +1,75 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+class RunJournal:
+    """
+    Append-only, fsync'd log of completed (threat, chunk) LLM results.
+
+    Each line stores the hash of the request inputs (provider, model,
+    system prompt and prompt, which covers the threat and the chunk's
+    requirements) with the raw response. A restarted run with the same
+    inputs finds its finished chunks here and only sends the rest.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.resumed = 0
+        self.recorded = 0
+        self._results = {}
+        self._lock = threading.Lock()
+        self._load()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    self._results[entry["key"]] = entry["response"]
+                except (json.JSONDecodeError, KeyError):
+                    # A crash can leave a partially written last line; ignore it
+                    continue
+
+    def __len__(self):
+        return len(self._results)
+
+    @staticmethod
+    def make_key(provider, model, system_prompt, prompt) -> str:
+        key_string = f"{provider}\x00{model}\x00{system_prompt or ''}\x00{prompt}"
+        return hashlib.sha256(key_string.encode("utf-8")).hexdigest()
+
+    def get(self, key, usable=None):
+        """The recorded response for `key`, unless `usable` rejects it (then it is asked again)."""
+        response = self._results.get(key)
+        if response is not None and usable is not None and not usable(response):
+            return None
+        if response is not None:
+            self.resumed += 1
+        return response
+
+    def record(self, key, response, **meta):
+        entry = {"key": key, "response": response, "time": time.time(), **meta}
+        with self._lock:
+            self._file.write(json.dumps(entry, default=str) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._results[key] = response
+            self.recorded += 1
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def remove(self):
+        """Close and delete the journal (after the run's output has been saved)."""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,155 @@
+import os
+import json
+import hashlib
+import tempfile
+from llm_config import get_llm_config
+
+# Threat fields that end up in the prompt; other columns don't affect the mapping
+THREAT_FIELDS = ("Id", "Title", "Category", "Interaction", "Description")
+
+def _digest(*parts) -> str:
+    return hashlib.sha256("\x00".join(str(p) for p in parts).encode("utf-8")).hexdigest()[:20]
+
+def threat_fingerprint(threat: dict) -> str:
+    return _digest(*(threat.get(field, "") for field in THREAT_FIELDS))
+
+def requirement_fingerprint(req: dict) -> str:
+    # Only ID and text are sent to the LLM; asset changes show up as candidate set changes
+    return _digest(req["id"], req["text"])
+
+def requirement_key(value) -> str:
+    """Requirement ID as written by us or the LLM, with or without [brackets]."""
+    return str(value).strip().strip("[]")
+
+def threat_keys(threats) -> list:
+    """Stable key per threat: its Id, suffixed with #n for repeated Ids."""
+    seen = {}
+    keys = []
+    for threat in threats:
+        threat_id = str(threat.get("Id", ""))
+        seen[threat_id] = seen.get(threat_id, 0) + 1
+        keys.append(threat_id if seen[threat_id] == 1 else f"{threat_id}#{seen[threat_id]}")
+    return keys
+
+class RunManifest:
+    """
+    Content hashes of the last completed run, stored next to the output file.
+
+    For every threat it records the threat's fingerprint, the fingerprints of
+    its candidate requirements and the mitigations found. On the next run
+    plan() compares the new workbooks against it:
+    - new or edited threats are re-mapped against all their candidates
+    - unchanged threats only send requirements that were added to their
+      candidate set or whose text changed; mitigations for unchanged
+      requirements are carried over, those for edited/removed ones (or for
+      IDs that were never candidates) dropped
+    - threats with no changes at all are not sent to the LLM
+
+    Candidates whose chunk failed (see merge) aren't recorded, so they count
+    as new on the next run and are sent again.
+
+    A manifest written with a different provider, model or prompt context is
+    ignored, so every threat is re-mapped; so is everything with full=True.
+    """
+
+    def __init__(self, path: str, rmp_context, req_structure_hint, asset_list=None, full=False):
+        config = get_llm_config()
+        self.path = path
+        self.settings = _digest(json.dumps({
+            "provider": config["provider"],
+            "model": config["model"],
+            "rmp_context": rmp_context,
+            "req_structure_hint": req_structure_hint,
+            "asset_list": asset_list,
+        }, sort_keys=True, default=str))
+        self.reused = 0
+        self.partial = 0
+        self.remapped = 0
+        self._previous = {} if full else self._load()
+        self._current = {}
+        self._keys = []
+        self._hashes = []
+        self._candidates = []
+        self._carried = []
+
+    def _load(self) -> dict:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+        if data.get("settings") != self.settings:
+            return {}
+        return data.get("threats", {})
+
+    def __len__(self):
+        return len(self._previous)
+
+    def plan(self, threats, candidate_lists) -> list:
+        """
+        Work out what has to be (re)computed: returns the requirements to send
+        to the LLM for each threat, aligned with `threats`.
+        """
+        self._keys = threat_keys(threats)
+        self._hashes = [threat_fingerprint(t) for t in threats]
+        self._candidates = [
+            {requirement_key(r["id"]): requirement_fingerprint(r) for r in candidates}
+            for candidates in candidate_lists
+        ]
+
+        to_send = []
+        self._carried = []
+        for key, threat_hash, hashes, candidates in zip(self._keys, self._hashes, self._candidates, candidate_lists):
+            previous = self._previous.get(key)
+            if previous is None or previous["hash"] != threat_hash:
+                self.remapped += 1
+                to_send.append(candidates)
+                self._carried.append([])
+                continue
+
+            old = previous["candidates"]
+            changed = [r for r in candidates if old.get(requirement_key(r["id"])) != hashes[requirement_key(r["id"])]]
+            if changed:
+                self.partial += 1
+            else:
+                self.reused += 1
+            to_send.append(changed)
+            # Only mitigations for requirements that were, and still are, the same candidate carry over
+            self._carried.append([
+                m for m in previous["mitigations"]
+                if requirement_key(m["requirement"]) in old
+                and old[requirement_key(m["requirement"])] == hashes.get(requirement_key(m["requirement"]))
+            ])
+        return to_send
+
+    def merge(self, position: int, mitigations: list, failed=()) -> list:
+        """
+        Combine the new mitigations of the threat at `position` (as passed to
+        plan) with the carried-over ones, in candidate order, and record them.
+        `failed` holds the requirement keys of chunks without a usable answer;
+        they are left out of the recorded candidates (with any mitigations
+        that did arrive for them) so the next run re-sends them.
+        """
+        order = {rid: n for n, rid in enumerate(self._candidates[position])}
+        mitigations = sorted(
+            self._carried[position] + mitigations,
+            key=lambda m: order.get(requirement_key(m["requirement"]), len(order))
+        )
+        failed = set(failed)
+        self._current[self._keys[position]] = {
+            "hash": self._hashes[position],
+            "candidates": {rid: h for rid, h in self._candidates[position].items() if rid not in failed},
+            "mitigations": [m for m in mitigations if requirement_key(m["requirement"]) not in failed],
+        }
+        return mitigations
+
+    def save(self):
+        """Write the manifest for this run; call once the output has been saved."""
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".", suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"settings": self.settings, "threats": self._current}, f)
+        os.replace(tmp, self.path)
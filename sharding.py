@@ -0,0 +1,115 @@
+import os
+import re
+import sys
+import glob
+import zlib
+import subprocess
+from collections import Counter
+from run_manifest import threat_keys
+
+# Original row number in the threat workbook, carried through shard outputs for the merge
+POSITION_COLUMN = "_Threat Row"
+
+def parse_shard(spec: str) -> tuple:
+    """Parse "i/n" (1-based, e.g. "2/4") into (i, n)."""
+    match = re.fullmatch(r"\s*(\d+)\s*/\s*(\d+)\s*", spec or "")
+    if not match:
+        raise ValueError(f"Invalid shard '{spec}': expected i/n, e.g. 1/4")
+    index, count = int(match.group(1)), int(match.group(2))
+    if not 1 <= index <= count:
+        raise ValueError(f"Invalid shard '{spec}': i must be between 1 and n")
+    return index, count
+
+def shard_of(key: str, count: int) -> int:
+    """1-based shard a threat key belongs to; stable across processes and machines."""
+    return zlib.crc32(key.encode("utf-8")) % count + 1
+
+def select_shard(threats_df, index: int, count: int):
+    """
+    Rows of the threat workbook that belong to shard `index` of `count`.
+
+    Threats are assigned by a hash of their Id (not their row number), so
+    adding or removing rows doesn't move other threats to another shard and
+    each shard's incremental manifest stays valid. The original row number
+    is kept in POSITION_COLUMN for merge_shards.
+    """
+    threats_df = threats_df.assign(**{POSITION_COLUMN: range(len(threats_df))})
+    keys = threat_keys(threats_df.to_dict("records"))
+    mask = [shard_of(key, count) == index for key in keys]
+    return threats_df[mask].reset_index(drop=True)
+
+def shard_output_path(output_file: str, index: int, count: int) -> str:
+    stem, extension = os.path.splitext(output_file)
+    return f"{stem}.shard-{index}-of-{count}{extension}"
+
+def find_shard_outputs(output_file: str) -> list:
+    """Partial results of the most recent sharding of `output_file`, checked for completeness."""
+    stem, extension = os.path.splitext(output_file)
+    pattern = re.compile(re.escape(os.path.basename(stem)) + r"\.shard-(\d+)-of-(\d+)" + re.escape(extension) + "$")
+    shards = {}
+    for path in glob.glob(f"{glob.escape(stem)}.shard-*-of-*{extension}"):
+        match = pattern.match(os.path.basename(path))
+        if match:
+            shards.setdefault(int(match.group(2)), {})[int(match.group(1))] = path
+    if not shards:
+        raise FileNotFoundError(f"No shard outputs found for {output_file}")
+
+    count = max(shards, key=lambda n: max(os.path.getmtime(p) for p in shards[n].values()))
+    missing = [i for i in range(1, count + 1) if i not in shards[count]]
+    if missing:
+        raise FileNotFoundError(f"Missing shard outputs {missing} of {count} for {output_file}")
+    return [shards[count][i] for i in range(1, count + 1)]
+
+def merge_shards(output_file: str, threat_count: int) -> int:
+    """
+    Combine the shard outputs of `output_file` into it, in the original
+    threat order. Returns the number of rows written.
+
+    Raises ValueError, leaving any existing output untouched, unless the
+    shards cover each of the `threat_count` threat workbook rows exactly
+    once (an interrupted shard leaves a partial output behind).
+    """
+    from result_writer import read_results, StreamingResultWriter
+
+    rows = []
+    for path in find_shard_outputs(output_file):
+        rows.extend(read_results(path))
+        print(f"📥 {path}")
+
+    rows.sort(key=lambda row: int(row[POSITION_COLUMN]))
+    positions = [int(row[POSITION_COLUMN]) for row in rows]
+    if positions != list(range(threat_count)):
+        counts = Counter(positions)
+        missing = [p for p in range(threat_count) if p not in counts]
+        duplicated = [p for p, n in counts.items() if n > 1]
+        extra = [p for p in counts if not 0 <= p < threat_count]
+        raise ValueError(
+            f"Shard outputs don't cover the {threat_count} threat rows exactly once: "
+            f"{len(missing)} missing (first positions {missing[:10]}), "
+            f"{len(duplicated)} duplicated, {len(extra)} out of range"
+        )
+
+    with StreamingResultWriter(output_file) as writer:
+        for row in rows:
+            writer.write({k: v for k, v in row.items() if k != POSITION_COLUMN})
+    return len(rows)
+
+def run_local_shards(count: int, extra_args=(), api_keys=None, provider=None) -> list:
+    """
+    Run `main.py --shard i/count` for every shard as parallel processes on
+    this machine and wait for them. With api_keys, worker i uses key
+    i % len(api_keys) for the provider. Returns the workers' exit codes.
+    """
+    from llm_config import API_KEY_ENV
+
+    main_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    provider = (provider or os.getenv("LLM_PROVIDER", "openai")).lower()
+    workers = []
+    for index in range(1, count + 1):
+        env = dict(os.environ)
+        if api_keys:
+            env[API_KEY_ENV[provider]] = api_keys[(index - 1) % len(api_keys)]
+        command = [sys.executable, main_py, "--shard", f"{index}/{count}", *extra_args]
+        print(f"🧵 Starting shard {index}/{count}")
+        workers.append(subprocess.Popen(command, env=env))
+    return [worker.wait() for worker in workers]
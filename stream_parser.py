@@ -0,0 +1,98 @@
+import re
+import json
+from run_manifest import requirement_key
+
+MITIGATIONS_KEY = re.compile(r'"mitigations"\s*:\s*$')
+
+class MitigationStreamParser:
+    """
+    Incremental parser for a streamed {"mitigations": [...]} answer.
+
+    feed() takes text deltas as they arrive and returns every
+    {"requirement", "justification"} object completed by that delta, without
+    waiting for the rest of the JSON. Requirements that are not among
+    `valid_ids` (the chunk that was sent) or that were already returned are
+    rejected on the spot. Only objects directly inside the "mitigations"
+    array of a root object count, and `done` turns True once such a root
+    object closes; brackets or objects in any preamble text are skipped.
+    """
+
+    def __init__(self, valid_ids=None):
+        self.valid_ids = {requirement_key(i) for i in valid_ids} if valid_ids is not None else None
+        self.mitigations = []
+        self.rejected = []
+        self.duplicates = 0
+        self.done = False
+        self.chars = 0
+        self._text = ""
+        self._pos = 0
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._seen = set()
+
+    def feed(self, delta: str) -> list:
+        self.chars += len(delta)
+        self._text += delta
+        completed = []
+        text = self._text
+        while self._pos < len(text) and not self.done:
+            ch = text[self._pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                # Quotes in prose around the JSON don't open strings
+                self._in_string = bool(self._stack)
+            elif ch in "{[":
+                # An array is the answer's list if it's the "mitigations" value of a root object
+                is_list = (ch == "[" and len(self._stack) == 1 and self._stack[0][0] == "{"
+                           and MITIGATIONS_KEY.search(text, self._stack[0][1], self._pos) is not None)
+                if is_list:
+                    self._stack[0] = ("{", self._stack[0][1], True)
+                self._stack.append((ch, self._pos, is_list))
+            elif ch in "}]" and self._stack:
+                opener, start, flag = self._stack.pop()
+                if ch == "}" and opener == "{" and self._stack and self._stack[-1][2] and len(self._stack) == 2:
+                    mitigation = self._accept(text[start:self._pos + 1])
+                    if mitigation is not None:
+                        completed.append(mitigation)
+                if not self._stack and flag and opener == "{":
+                    self.done = True
+            self._pos += 1
+        return completed
+
+    def _accept(self, fragment: str):
+        try:
+            entry = json.loads(fragment)
+        except json.JSONDecodeError:
+            return None
+        if not isinstance(entry, dict) or "requirement" not in entry:
+            return None
+        req_id = str(entry.get("requirement") or "").strip()
+        if not req_id:
+            return None
+        key = requirement_key(req_id)
+        if self.valid_ids is not None and key not in self.valid_ids:
+            self.rejected.append(req_id)
+            return None
+        if key in self._seen:
+            self.duplicates += 1
+            return None
+        self._seen.add(key)
+        mitigation = {"requirement": req_id, "justification": str(entry.get("justification") or "").strip()}
+        self.mitigations.append(mitigation)
+        return mitigation
+
+    @property
+    def all_answered(self) -> bool:
+        """Every requirement of the chunk has been returned; nothing useful can follow."""
+        return self.valid_ids is not None and len(self._seen) >= len(self.valid_ids)
+
+    def to_json(self) -> str:
+        """The accepted mitigations in the regular (non-streaming) answer format."""
+        return json.dumps({"mitigations": self.mitigations})
@@ -2,29 +2,22 @@ import streamlit as st
 from dotenv import load_dotenv
 import os
 import pandas as pd
-import uuid
-import glob
+import time
 import base64
+import hashlib
+import threading
 
-from llm_config import get_llm_config
-from llm_utils import call_llm, clear_cache_file
-from data_loader import read_threats, read_requirements
-from threat_processor import process_threats
+from llm_config import get_llm_config, llm_overrides, API_KEY_ENV
+from llm_utils import clear_cache_file, get_cache_stats
+from data_loader import read_threats, read_requirements, read_columns, REQUIREMENT_COLUMNS, THREAT_COLUMNS
+from threat_processor import stream_threats
 from file_paths import get_rmp_fallback_description, get_requirement_format_description
+from llm_threat_mapper import get_asset_aliases
+from metrics import RunMetrics, use_metrics
 
 load_dotenv()
 st.set_page_config(page_title="Threat Mapper", layout="wide")
 
-# ✅ Auto-delete old uploaded files when app starts
-def clean_old_uploaded_files():
-    for file in glob.glob("uploaded_*.xlsx"):
-        try:
-            os.remove(file)
-        except Exception as e:
-            st.warning(f"⚠️ Couldn't delete old file: {file} ({e})")
-
-clean_old_uploaded_files()
-
 # ✅ Background image setup
 def set_background(image_path):
     with open(image_path, "rb") as img_file:
@@ -54,6 +47,28 @@ def set_background(image_path):
         unsafe_allow_html=True
     )
 
+# --- Cached resources: parsed workbooks are keyed by the upload's content hash,
+# so reruns and config changes don't parse them again
+def file_hash(uploaded_file) -> str:
+    return hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+
+@st.cache_data(show_spinner=False)
+def load_columns(digest, _uploaded_file):
+    return read_columns(_uploaded_file)
+
+@st.cache_data(show_spinner="📖 Reading threats...")
+def load_threats(digest, _uploaded_file):
+    return read_threats(_uploaded_file)
+
+@st.cache_data(show_spinner="📖 Reading requirements...")
+def load_requirements(digest, _uploaded_file):
+    return read_requirements(_uploaded_file)
+
+@st.cache_resource(show_spinner="🧠 Loading embedding model...")
+def load_embedding_model():
+    from model_registry import get_embedding_model
+    return get_embedding_model()
+
 #set_background("cyber_banner.png")
 st.title("🔐 Protype: Threat-to-Requirement Mapping Tool")
 
@@ -66,14 +81,13 @@ with col2:
     threat_file = st.file_uploader("💀 Upload Threats Excel", type=["xlsx"])
 
 # --- Column validation
-required_req_columns = {"Requirement ID", "Description", "Assets Allocated to"}
-required_threat_columns = {"Id", "Title", "Category", "Interaction", "Description"}
+required_req_columns = set(REQUIREMENT_COLUMNS)
+required_threat_columns = set(THREAT_COLUMNS)
 
 # Requirements Validation
 if req_file:
     try:
-        req_df = pd.read_excel(req_file)
-        missing_req = required_req_columns - set(req_df.columns)
+        missing_req = required_req_columns - set(load_columns(file_hash(req_file), req_file))
         if missing_req:
             st.error("❌ The uploaded Requirements file is missing the following required columns:\n\n"
                      + "\n".join(f"- {col}" for col in missing_req) +
@@ -87,8 +101,7 @@ if req_file:
 # Threats Validation
 if threat_file:
     try:
-        threat_df = pd.read_excel(threat_file)
-        missing_threat = required_threat_columns - set(threat_df.columns)
+        missing_threat = required_threat_columns - set(load_columns(file_hash(threat_file), threat_file))
         if missing_threat:
             st.error("❌ The uploaded Threats file is missing the following required columns:\n\n"
                      + "\n".join(f"- {col}" for col in missing_threat) +
@@ -99,76 +112,171 @@ if threat_file:
         st.error(f"❌ Failed to read Threats file: {e}")
         st.stop()
 
-if req_file:
-    req_file.seek(0)
-if threat_file:
-    threat_file.seek(0)
-
 # --- Advanced Configuration
 with st.expander("⚙️ Advanced Configuration", expanded=False):
     model_provider = st.selectbox("Choose LLM Provider", ["openai", "mistral", "groq"])
     user_key = st.text_input(f"{model_provider.capitalize()} API Key (Optional, overrides .env)", type="password")
+    llm_routes = st.text_input("🔀 Route across backends (e.g. openai, groq:llama3-70b-8192; empty = off)",
+                               value=os.getenv("LLM_ROUTES", ""))
 
     chunk_size = st.number_input("📦 Chunk size (1–10)", min_value=1, max_value=10, value=5)
+    pack_tokens = st.checkbox("📐 Pack chunks up to the model's token budget (ignores chunk size)", value=False)
+    semantic_top_k = st.number_input("🎯 Semantic pre-filter: top-k requirements per threat (0 = off)",
+                                     min_value=0, max_value=500, value=0)
+    threat_batch_size = st.number_input("🧩 Threats per prompt when they share candidates (1 = off)",
+                                        min_value=1, max_value=20, value=1)
+    category_filter = st.checkbox("🧭 Pre-filter requirements by STRIDE category relevance", value=False)
+    dedupe = st.checkbox("🧬 Map one representative per cluster of duplicate threats", value=False)
+    dedupe_threshold = st.number_input("🧬 Also cluster threats with embedding similarity ≥ (0 = exact text only)",
+                                       min_value=0.0, max_value=1.0, value=0.0, step=0.01)
+    concurrency = st.number_input("⚡ Concurrent LLM requests", min_value=1, max_value=32,
+                                  value=min(32, get_llm_config(model_provider)["max_concurrency"]))
+    cascade = st.checkbox("🪜 Cascade: screen candidates with a cheap model, justify only those that pass",
+                          value=False)
+    stream_responses = st.checkbox("📡 Stream LLM answers (validate IDs on the fly, cut off runaway output)",
+                                   value=get_llm_config(model_provider)["stream"])
     enable_cache = st.checkbox("💾 Enable caching", value=True)
     clear_cache = st.checkbox("🧹 Clear cache before run", value=False)
     print_tokens = st.checkbox("🔢 Print token count", value=True)
     print_logs = st.checkbox("📜 Print LLM responses", value=False)
     asset_list = st.text_area("🧱 Known assets (comma-separated)",
                               value="vCenter, Server, Switch, Firewall, NTP, OS ESXi, Workstation, BR Solution")
-
-env_key_map = {
-    "openai": "OPENAI_API_KEY",
-    "mistral": "OPENROUTER_API_KEY",
-    "groq": "GROQ_API_KEY"
-}
-os.environ["LLM_PROVIDER"] = model_provider
-if user_key:
-    os.environ[env_key_map[model_provider]] = user_key
+    asset_aliases = st.text_area("🔗 Asset aliases (one per line: alias = asset1, asset2)",
+                                 value="\n".join(f"{alias} = {', '.join(names)}"
+                                                 for alias, names in get_asset_aliases().items()))
 
 # --- Main runner
-def run_matching(req_path, threat_path, chunk_size, print_tokens, print_logs, asset_list):
-    threats_df = read_threats(threat_path)
-    requirements = read_requirements(req_path)
-    rmp_context = get_rmp_fallback_description()
-    req_structure_hint = get_requirement_format_description()
-
-    return process_threats(
-        threats_df,
-        requirements,
-        "",  # system_summary not used
-        rmp_context,
-        req_structure_hint,
-        chunk_size=chunk_size,
-        print_tokens=print_tokens,
-        print_logs=print_logs,
-        asset_list=[a.strip() for a in asset_list.split(",") if a.strip()]
-    )
+def parse_asset_aliases(text):
+    return {
+        alias.strip(): [n.strip() for n in names.split(",") if n.strip()]
+        for alias, names in (line.split("=", 1) for line in text.splitlines() if "=" in line)
+    }
+
+class MatchingJob:
+    """
+    Runs stream_threats in a background thread. The script only reads
+    `rows` / `done` / `error` on each rerun, so the page stays responsive
+    and the results table fills in while threats are being mapped.
+
+    The provider / key / routes settings are pinned when the job starts
+    (llm_overrides), so widget changes and other sessions can't switch its
+    in-flight requests, and the job collects its own metrics.
+    """
+
+    def __init__(self, threats_df, requirements, llm_settings, **options):
+        self.total = len(threats_df)
+        self.rows = []
+        self.done = False
+        self.error = None
+        self.started = time.time()
+        self.ended = None
+        self.metrics = RunMetrics()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, args=(threats_df, requirements, llm_settings), kwargs=options, daemon=True
+        )
+        self._thread.start()
+
+    def _run(self, threats_df, requirements, llm_settings, **options):
+        with llm_overrides(**llm_settings), use_metrics(self.metrics):
+            stream = stream_threats(
+                threats_df,
+                requirements,
+                "",  # system_summary not used
+                get_rmp_fallback_description(),
+                get_requirement_format_description(),
+                **options
+            )
+            try:
+                for _, row in stream:
+                    self.rows.append(row)
+                    if self._stop.is_set():
+                        break
+            except Exception as e:
+                self.error = e
+            finally:
+                stream.close()  # cancels in-flight requests when stopped early
+                self.ended = time.time()
+                self.done = True
+
+    def stop(self):
+        self._stop.set()
+
+    @property
+    def stopped(self):
+        return self._stop.is_set()
+
+    def result_df(self):
+        return pd.DataFrame(list(self.rows))
 
 # --- Trigger
-if st.button("🚀 Run Matching") and req_file and threat_file:
-    st.write("🔍 Processing...")
+job = st.session_state.get("matching_job")
+running = job is not None and not job.done
 
+if st.button("🚀 Run Matching", disabled=running) and req_file and threat_file:
     if clear_cache:
         clear_cache_file()
         st.info("✅ Cache cleared.")
+    if semantic_top_k or category_filter or (dedupe and dedupe_threshold):
+        load_embedding_model()
 
-    req_path = f"uploaded_{uuid.uuid4().hex}_requirements.xlsx"
-    threat_path = f"uploaded_{uuid.uuid4().hex}_threats.xlsx"
-    with open(req_path, "wb") as f:
-        f.write(req_file.read())
-    with open(threat_path, "wb") as f:
-        f.write(threat_file.read())
+    # Snapshot of this session's backend settings; the environment stays untouched
+    llm_settings = {"LLM_PROVIDER": model_provider, "LLM_ROUTES": llm_routes}
+    if user_key:
+        llm_settings[API_KEY_ENV[model_provider]] = user_key
 
-    try:
-        result_df = run_matching(req_path, threat_path, chunk_size, print_tokens, print_logs, asset_list)
-    finally:
-        try:
-            os.remove(req_path)
-            os.remove(threat_path)
-        except Exception as e:
-            st.warning(f"⚠️ Failed to clean up uploaded files: {e}")
-
-    st.success("✅ Matching completed!")
+    # Uploads are parsed straight from memory (and cached by content hash); no temporary copies on disk
+    job = MatchingJob(
+        load_threats(file_hash(threat_file), threat_file),
+        load_requirements(file_hash(req_file), req_file),
+        llm_settings,
+        chunk_size=chunk_size,
+        print_tokens=print_tokens,
+        print_logs=print_logs,
+        asset_list=[a.strip() for a in asset_list.split(",") if a.strip()],
+        concurrency=concurrency,
+        use_cache=enable_cache,
+        pack_tokens=pack_tokens,
+        semantic_top_k=semantic_top_k or None,
+        category_filter=category_filter,
+        asset_aliases=parse_asset_aliases(asset_aliases),
+        threat_batch_size=threat_batch_size,
+        stream_responses=stream_responses,
+        dedupe=dedupe,
+        dedupe_threshold=dedupe_threshold or None,
+        cascade=cascade
+    )
+    st.session_state["matching_job"] = job
+    running = True
+
+if job is not None:
+    finished = len(job.rows)
+    st.progress(finished / max(job.total, 1),
+                text=f"🔍 {finished}/{job.total} threats mapped ({(job.ended or time.time()) - job.started:.0f}s)")
+
+    if running:
+        if st.button("⏹️ Stop", disabled=job.stopped):
+            job.stop()
+    elif job.error is not None:
+        st.error(f"❌ Matching failed: {job.error}")
+    elif job.stopped:
+        st.warning(f"⏹️ Matching stopped after {finished} of {job.total} threats.")
+    else:
+        st.success("✅ Matching completed!")
+        if enable_cache:
+            report = job.metrics.report()
+            st.caption(f"💾 Cache: {report['events'].get('cache_hits', 0)} hits, "
+                       f"{report['events'].get('cache_misses', 0)} misses "
+                       f"({report['cache_hit_rate']:.0%} hit rate, {get_cache_stats()['entries']} entries stored)")
+
+    result_df = job.result_df()
     st.dataframe(result_df)
-    st.download_button("💾 Download Results", result_df.to_csv(index=False).encode(), "matched_results.csv", "text/csv")
+    if not running:
+        st.download_button("💾 Download Results", result_df.to_csv(index=False).encode(),
+                           "matched_results.csv", "text/csv")
+        with st.expander("📊 Run metrics", expanded=False):
+            st.json(job.metrics.report())
+    else:
+        # Poll the worker: rerun the script to refresh progress and the table
+        time.sleep(1)
+        st.rerun()
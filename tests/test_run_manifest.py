@@ -0,0 +1,67 @@
+import re
+import json
+import httpx
+import pandas as pd
+import pytest
+
+import llm_cache
+import threat_processor
+from run_manifest import RunManifest
+
+REQUIREMENTS = [{"id": f"R{i}", "text": f"Control {i}", "assets": "vCenter"} for i in range(6)]
+THREATS = pd.DataFrame([
+    {"Id": i, "Title": f"Threat {i}", "Category": "Spoofing", "Interaction": "vCenter to NTP",
+     "Description": f"Spoofing case {i}"}
+    for i in range(5)
+])
+
+@pytest.fixture
+def provider(monkeypatch, tmp_path):
+    """Mock chat completions endpoint that answers in prose while `broken` is set."""
+    monkeypatch.setenv("LLM_PROVIDER", "openai")
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.delenv("LLM_ROUTES", raising=False)
+    monkeypatch.setattr(llm_cache, "_cache", llm_cache.LLMResponseCache(str(tmp_path / "cache.sqlite")))
+    state = {"broken": True, "requests": 0}
+
+    def handler(request):
+        state["requests"] += 1
+        prompt = json.loads(request.content)["messages"][-1]["content"]
+        if state["broken"]:
+            content = "I'm sorry, I can't help with that."
+        else:
+            content = json.dumps({"mitigations": [
+                {"requirement": rid, "justification": "Covers it."} for rid in re.findall(r"ID: (R\d+)", prompt)
+            ]})
+        return httpx.Response(200, json={"choices": [{"message": {"content": content}}]})
+
+    monkeypatch.setattr(threat_processor, "make_async_client",
+                        lambda config, max_connections=None: httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    yield state
+    llm_cache.get_cache().close()
+
+def run(path):
+    manifest = RunManifest(str(path), "context", "hint")
+    output = threat_processor.process_threats(
+        THREATS, REQUIREMENTS, "", "context", "hint", asset_list=["vCenter"],
+        use_cache=True, stream_responses=False, manifest=manifest
+    )
+    manifest.save()
+    return output, manifest
+
+def test_failed_chunks_are_sent_again_after_the_provider_recovers(provider, tmp_path):
+    path = tmp_path / "out.xlsx.manifest.json"
+    output, _ = run(path)
+    assert (output["Mitigating Requirements"] == "None").all()
+
+    provider["broken"] = False
+    output, manifest = run(path)
+    assert manifest.reused == 0
+    assert output["Mitigating Requirements"].tolist() == ["R0; R1; R2; R3; R4; R5"] * len(THREATS)
+
+    # Nothing left to send: the answers come from the manifest
+    requests = provider["requests"]
+    output, manifest = run(path)
+    assert provider["requests"] == requests
+    assert manifest.reused == len(THREATS)
+    assert output["Mitigating Requirements"].tolist() == ["R0; R1; R2; R3; R4; R5"] * len(THREATS)
@@ -0,0 +1,30 @@
+import numpy as np
+
+import embedding_store
+import vector_search
+from vector_search import RequirementVectorSearch
+
+class FakeModel:
+    """Stands in for the sentence-transformers model: one normalized random vector per text."""
+
+    def encode(self, texts, convert_to_numpy=True, normalize_embeddings=True):
+        vectors = np.random.default_rng(len(texts)).normal(size=(len(texts), 8))
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+THREATS = [
+    {"Title": "Spoofing", "Description": "Spoofed NTP server", "Interaction": "vCenter to NTP"},
+    {"Title": "Tampering", "Description": "Altered backups", "Interaction": "BR Solution to Server"},
+]
+
+def search(monkeypatch, tmp_path, requirements):
+    monkeypatch.setattr(vector_search, "get_embedding_model", lambda name=None: FakeModel())
+    monkeypatch.setattr(embedding_store, "get_embedding_model", lambda name=None: FakeModel())
+    return RequirementVectorSearch(requirements, store=embedding_store.EmbeddingStore(directory=str(tmp_path)))
+
+def test_empty_catalogue_gives_empty_candidate_sets(monkeypatch, tmp_path):
+    assert search(monkeypatch, tmp_path, []).get_candidates_batch(THREATS, k=5, threshold=0.2) == [set(), set()]
+
+def test_top_k_per_threat(monkeypatch, tmp_path):
+    requirements = [{"id": f"R{i}", "text": f"Control {i}", "assets": "vCenter"} for i in range(6)]
+    candidates = search(monkeypatch, tmp_path, requirements).get_candidates_batch(THREATS, k=2)
+    assert [len(c) for c in candidates] == [2, 2]
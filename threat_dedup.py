@@ -0,0 +1,97 @@
+import re
+import numpy as np
+from model_registry import DEFAULT_EMBEDDING_MODEL, get_embedding_model
+
+def interaction_parts(interaction: str) -> list:
+    """Source, destination and flow label of 'AssetA to AssetB: flow' (whichever are present)."""
+    endpoints, _, flow = str(interaction or "").partition(":")
+    parts = re.split(r"\s+to\s+", endpoints.strip(), maxsplit=1, flags=re.IGNORECASE)
+    return [p.strip() for p in parts + [flow] if p.strip()]
+
+def normalize_threat_text(threat: dict) -> str:
+    """
+    Title + description with the interaction's own names taken out, so the
+    same STRIDE template on different interactions normalizes to the same
+    text: endpoint and flow names become "<asset>", then case, punctuation
+    and whitespace are folded.
+    """
+    text = f"{threat.get('Title', '')} {threat.get('Description', '')}"
+    for name in sorted(interaction_parts(threat.get("Interaction", "")), key=len, reverse=True):
+        text = re.sub(rf"(?<!\w){re.escape(name)}(?!\w)", " <asset> ", text, flags=re.IGNORECASE)
+    text = re.sub(r"[^\w<>]+", " ", text.lower())
+    return " ".join(text.split())
+
+def cluster_threats(threats, candidate_lists, similarity_threshold=None, model_name=DEFAULT_EMBEDDING_MODEL) -> list:
+    """
+    Group threat positions that would get the same answer from the LLM.
+
+    Threats can only share a cluster if they have the same STRIDE category
+    and identical candidate requirement sets. Within that, threats with the
+    same normalized text are merged, and with similarity_threshold the
+    remaining texts are also merged when their embeddings have at least that
+    cosine similarity to the cluster's leading text (needs sentence-transformers).
+
+    Returns clusters of positions in threat order; the first position is
+    the representative. Threats without candidates are left out.
+    """
+    buckets = {}
+    for i, candidates in enumerate(candidate_lists):
+        if not candidates:
+            continue
+        key = (str(threats[i].get("Category", "")).strip().lower(), tuple(r["id"] for r in candidates))
+        buckets.setdefault(key, {}).setdefault(normalize_threat_text(threats[i]), []).append(i)
+
+    if similarity_threshold is None:
+        clusters = [positions for texts in buckets.values() for positions in texts.values()]
+        return sorted(clusters, key=lambda cluster: cluster[0])
+
+    texts = [text for by_text in buckets.values() for text in by_text]
+    if not texts:
+        return []
+    vectors = get_embedding_model(model_name).encode(
+        texts, convert_to_numpy=True, normalize_embeddings=True
+    ).astype(np.float32)
+
+    clusters = []
+    offset = 0
+    for by_text in buckets.values():
+        # Greedy: each text joins the cluster with the most similar leading text, if similar enough
+        leaders, members = [], []
+        for j, positions in enumerate(by_text.values()):
+            vector = vectors[offset + j]
+            scores = [float(vectors[leader] @ vector) for leader in leaders]
+            best = int(np.argmax(scores)) if scores else -1
+            if best >= 0 and scores[best] >= similarity_threshold:
+                members[best].extend(positions)
+            else:
+                leaders.append(offset + j)
+                members.append(list(positions))
+        offset += len(by_text)
+        clusters.extend(sorted(cluster) for cluster in members)
+    return sorted(clusters, key=lambda cluster: cluster[0])
+
+def retarget_mitigations(mitigations, representative: dict, member: dict) -> list:
+    """
+    The representative's mitigations as answers for a duplicate: its
+    interaction's names in the justifications are swapped for the member's
+    (source for source, destination for destination, flow for flow), and
+    each justification says which threat it was worked out for.
+    """
+    names = dict(zip(
+        (name.lower() for name in interaction_parts(representative.get("Interaction", ""))),
+        interaction_parts(member.get("Interaction", ""))
+    ))
+    pattern = None
+    if names:
+        alternatives = "|".join(re.escape(name) for name in sorted(names, key=len, reverse=True))
+        pattern = re.compile(rf"(?<!\w)(?:{alternatives})(?!\w)", re.IGNORECASE)
+
+    retargeted = []
+    for m in mitigations:
+        justification = m["justification"]
+        if pattern is not None:
+            justification = pattern.sub(lambda match: names[match.group(0).lower()], justification)
+        retargeted.append({
+            **m, "justification": f"Same as threat {representative.get('Id', '')}: {justification}"
+        })
+    return retargeted
@@ -1,8 +1,117 @@
+import asyncio
 import pandas as pd
-from llm_matcher import match_threat_to_requirements
-from llm_threat_mapper import get_threat_assets, filter_requirements_by_assets
+from llm_config import get_llm_config, get_screen_settings
+from llm_utils import run_async, make_async_client
+from metrics import get_metrics
+from llm_matcher import (
+    match_threat_to_requirements_async,
+    match_threat_batch_async,
+    screen_requirements_async,
+    get_chunks,
+)
+from threat_dedup import cluster_threats, retarget_mitigations
+from llm_threat_mapper import (
+    get_asset_matcher,
+    filter_requirements_by_assets,
+    AssetIndex,
+    CategoryRelevanceIndex,
+)
 
-def process_threats(
+def apply_mitigations(threat: dict, mitigations: list) -> dict:
+    """
+    Write the LLM mitigations into the threat row's output columns.
+    """
+    if mitigations:
+        threat["Mitigating Requirements"] = "; ".join(m["requirement"] for m in mitigations)
+        threat["Justification"] = "\n\n".join(
+            f"{m['requirement']}: {m['justification']}" for m in mitigations
+        )
+    else:
+        threat["Mitigating Requirements"] = "None"
+        threat["Justification"] = "No applicable requirements identified by LLM."
+    return threat
+
+def semantic_prefilter(threats, requirements, top_k=None, threshold=None, print_logs=False) -> list:
+    """
+    Per threat, the set of requirement IDs kept by the vectorized semantic
+    pre-filter (top_k and/or cosine threshold), computed for all threats at once.
+    """
+    from vector_search import RequirementVectorSearch
+
+    search = RequirementVectorSearch(requirements)
+    candidates = search.get_candidates_batch(threats, k=top_k, threshold=threshold)
+    if print_logs:
+        print(f"🎯 Semantic pre-filter kept {sum(len(c) for c in candidates)} "
+              f"of {len(threats) * len(requirements)} threat/requirement pairs")
+    return candidates
+
+def group_threats_by_candidates(threats, candidate_lists, batch_size, positions=None) -> list:
+    """
+    Group threat positions whose candidate requirement sets are identical
+    (same fingerprint of requirement IDs) into batches of at most batch_size.
+    Threat IDs are kept unique within a batch so results can be split back.
+    """
+    groups = {}
+    for i in positions if positions is not None else range(len(candidate_lists)):
+        candidates = candidate_lists[i]
+        if not candidates:
+            continue
+        fingerprint = tuple(r["id"] for r in candidates)
+        groups.setdefault(fingerprint, []).append(i)
+
+    batches = []
+    for members in groups.values():
+        batch = []
+        for i in members:
+            if len(batch) >= batch_size or any(str(threats[j]["Id"]) == str(threats[i]["Id"]) for j in batch):
+                batches.append(batch)
+                batch = []
+            batch.append(i)
+        batches.append(batch)
+    return batches
+
+def build_work_units(threats, candidate_lists, threat_batch_size=1, positions=None) -> list:
+    """
+    Split threat positions (all of them, or only `positions`) into units of
+    LLM work: single threats, or batches of threats sharing a candidate set
+    when threat_batch_size > 1. Threats without candidates become their own
+    (LLM-free) unit. Units are ordered by their first threat so results can
+    be released in threat order.
+    """
+    positions = list(positions) if positions is not None else list(range(len(threats)))
+    if threat_batch_size > 1:
+        units = group_threats_by_candidates(threats, candidate_lists, threat_batch_size, positions)
+        units += [[i] for i in positions if not candidate_lists[i]]
+    else:
+        units = [[i] for i in positions]
+    return sorted(units, key=lambda unit: unit[0])
+
+def dedupe_threats(threats, candidate_lists, similarity_threshold=None, calls_per_threat=None,
+                   print_logs=False) -> dict:
+    """
+    Cluster threats that would get the same answer (see threat_dedup.cluster_threats)
+    and return {representative position: [member positions]} for clusters with
+    more than one threat. Only representatives are sent to the LLM.
+    `calls_per_threat(position)` estimates the LLM calls a threat costs, for
+    the report of calls saved.
+    """
+    clusters = [c for c in cluster_threats(threats, candidate_lists, similarity_threshold) if len(c) > 1]
+    followers = {cluster[0]: cluster[1:] for cluster in clusters}
+
+    duplicates = sum(len(members) for members in followers.values())
+    calls_saved = sum(
+        (calls_per_threat(representative) if calls_per_threat else 1) * len(members)
+        for representative, members in followers.items()
+    )
+    metrics = get_metrics()
+    metrics.incr("dedup_threats", duplicates)
+    metrics.incr("dedup_calls_saved", calls_saved)
+    if print_logs or duplicates:
+        print(f"🧬 {duplicates} duplicate threats in {len(clusters)} clusters answered from their "
+              f"representative; ~{calls_saved} LLM calls saved")
+    return followers
+
+async def stream_threats_async(
     threats_df,
     requirements,
     system_summary,
@@ -11,49 +120,314 @@ def process_threats(
     chunk_size=5,
     print_tokens=False,
     print_logs=False,
-    asset_list=None
-) -> pd.DataFrame:
+    asset_list=None,
+    concurrency=None,
+    use_cache=True,
+    pack_tokens=False,
+    semantic_top_k=None,
+    semantic_threshold=None,
+    category_filter=False,
+    category_threshold=0.6,
+    asset_aliases=None,
+    threat_batch_size=1,
+    ordered=True,
+    max_pending=None,
+    journal=None,
+    manifest=None,
+    stream_responses=None,
+    dedupe=False,
+    dedupe_threshold=None,
+    cascade=False
+):
     """
-    For each threat:
-    - Identify assets from the Interaction field
-    - Filter applicable requirements based on those assets
-    - Use LLM to suggest mitigations with justification
+    Async generator yielding (position, enriched threat row) as threats finish.
+
+    (threat, chunk) requests go over a pooled httpx.AsyncClient with at most
+    `concurrency` requests in flight (defaults to the provider's limit), and
+    at most `max_pending` threats are scheduled (or, with ordered=True, held
+    back waiting for an earlier one) at once, so memory stays flat however
+    many threats there are. With ordered=True rows are released in
+    the original threat order, otherwise in completion order.
     """
-    enriched_rows = []
+    config = get_llm_config()
+    limit = concurrency or config["max_concurrency"]
+    stream_responses = config["stream"] if stream_responses is None else stream_responses
+    semaphore = asyncio.Semaphore(limit)
+    max_pending = max_pending or limit * 4
+    if cascade:
+        screen = get_screen_settings()
+        if (screen["provider"], screen["model"]) == (config["provider"], config["model"]):
+            # Screening with the main model would double the calls instead of cutting them
+            print(f"⚠️ Cascade off: the screen model is the main model ({config['model']}); "
+                  f"set LLM_SCREEN_MODEL to a cheaper one")
+            cascade = False
 
-    for _, row in threats_df.iterrows():
-        threat = row.to_dict()
+    metrics = get_metrics()
+    threats = [row.to_dict() for _, row in threats_df.iterrows()]
+    with metrics.stage("filtering"):
+        asset_index = AssetIndex(requirements, aliases=asset_aliases)
+
+    # Step 0 (optional): semantic pre-filter for all threats in one batch
+    semantic_candidates = None
+    if semantic_top_k or semantic_threshold is not None:
+        with metrics.stage("filtering"):
+            semantic_candidates = semantic_prefilter(
+                threats, requirements, top_k=semantic_top_k, threshold=semantic_threshold, print_logs=print_logs
+            )
+
+    # Step 0b (optional): STRIDE category relevance, scored once for the whole requirement set
+    category_index = None
+    if category_filter:
+        with metrics.stage("filtering"):
+            category_index = CategoryRelevanceIndex(requirements, threshold=category_threshold)
+
+    # Compiled once per asset list; the prompt builder reuses its per-interaction memo
+    asset_matcher = get_asset_matcher(asset_list)
+
+    candidate_lists = []
+    for i, threat in enumerate(threats):
         interaction = threat.get("Interaction", "")
-        threat_assets = get_threat_assets(interaction, asset_list=asset_list or [])
+        with metrics.stage("asset_extraction"):
+            threat_assets = asset_matcher.extract(interaction)
 
         if print_logs:
             print(f"🔍 threat_assets: {threat_assets}")
 
-        # Step 1: Filter requirements by assets
-        relevant_reqs = filter_requirements_by_assets(requirements, threat_assets)
+        # Step 1: Filter requirements by assets (and by the semantic candidates, if any)
+        with metrics.stage("filtering"):
+            relevant_reqs = filter_requirements_by_assets(requirements, threat_assets, asset_index)
+            if semantic_candidates is not None:
+                relevant_reqs = [r for r in relevant_reqs if r["id"] in semantic_candidates[i]]
+            if category_index is not None:
+                relevant_reqs = category_index.filter(threat.get("Category", ""), relevant_reqs)
         if print_logs:
             print(f"🔍 relevant_reqs: {relevant_reqs}")
+        candidate_lists.append(relevant_reqs)
 
-        # Step 2: Get mitigations with justification
-        mitigations = match_threat_to_requirements(
-            threat=threat,
-            filtered_requirements=relevant_reqs,
-            rmp_context=rmp_context,
-            req_structure_hint=req_structure_hint,
-            chunk_size=chunk_size,
-            print_tokens=print_tokens,
-            print_logs=print_logs
-        )
+    # Step 1b (optional): incremental run, only send what changed since the last manifest
+    if manifest is not None:
+        candidate_lists = manifest.plan(threats, candidate_lists)
+        if print_logs:
+            print(f"♻️ {manifest.reused} threats unchanged, {manifest.partial} with changed requirements, "
+                  f"{manifest.remapped} new or edited")
 
-        if mitigations:
-            threat["Mitigating Requirements"] = "; ".join(m["requirement"] for m in mitigations)
-            threat["Justification"] = "\n\n".join(
-                f"{m['requirement']}: {m['justification']}" for m in mitigations
+    # Step 1c (optional): map one representative per cluster of duplicate threats
+    followers = {}
+    if dedupe:
+        with metrics.stage("dedup"):
+            followers = dedupe_threats(
+                threats, candidate_lists, similarity_threshold=dedupe_threshold,
+                calls_per_threat=lambda i: sum(1 for _ in get_chunks(
+                    threats[i], candidate_lists[i], rmp_context, req_structure_hint,
+                    chunk_size=chunk_size, pack_tokens=pack_tokens, asset_list=asset_list
+                )),
+                print_logs=print_logs
             )
-        else:
-            threat["Mitigating Requirements"] = "None"
-            threat["Justification"] = "No applicable requirements identified by LLM."
+    duplicates = {member for members in followers.values() for member in members}
+    representative_ids = {
+        member: threats[representative].get("Id", "")
+        for representative, members in followers.items() for member in members
+    }
+
+    units = build_work_units(threats, candidate_lists, threat_batch_size,
+                             positions=(i for i in range(len(threats)) if i not in duplicates))
+    if print_logs and threat_batch_size > 1:
+        print(f"📦 {len(threats) - len(duplicates)} threats grouped into {len(units)} work units")
 
-        enriched_rows.append(threat)
+    match_options = dict(
+        rmp_context=rmp_context,
+        req_structure_hint=req_structure_hint,
+        chunk_size=chunk_size,
+        print_tokens=print_tokens,
+        print_logs=print_logs,
+        use_cache=use_cache,
+        pack_tokens=pack_tokens,
+        asset_list=asset_list,
+        journal=journal
+    )
 
+    # Step 2: Get mitigations with justification
+    async with make_async_client(config, max_connections=limit) as client:
+        async def run_unit(unit):
+            candidates = candidate_lists[unit[0]]
+            if not candidates:
+                return [(i, [], set()) for i in unit]
+            if cascade:
+                # Cheap yes/no screen first; a batch keeps every candidate that passed for any of its threats
+                passed = await asyncio.gather(*(
+                    screen_requirements_async(
+                        threats[i], candidates, rmp_context, req_structure_hint, client, semaphore,
+                        print_logs=print_logs, asset_list=asset_list, use_cache=use_cache
+                    )
+                    for i in unit
+                ))
+                kept = {r["id"] for survivors in passed for r in survivors}
+                candidates = [r for r in candidates if r["id"] in kept]
+                if not candidates:
+                    return [(i, [], set()) for i in unit]
+            if len(unit) == 1:
+                mitigations, failed = await match_threat_to_requirements_async(
+                    threat=threats[unit[0]], filtered_requirements=candidates,
+                    client=client, semaphore=semaphore, stream=stream_responses, **match_options
+                )
+                return [(unit[0], mitigations, failed)]
+            results_per_threat = await match_threat_batch_async(
+                [threats[i] for i in unit], candidates,
+                client=client, semaphore=semaphore, **match_options
+            )
+            return [(i, mitigations, failed) for i, (mitigations, failed) in zip(unit, results_per_threat)]
+
+        remaining_units = iter(units)
+        pending = set()
+        finished = {}
+        next_position = 0
+        try:
+            while True:
+                # In ordered mode, rows held back behind a slow threat count against max_pending
+                # too; one unit is always allowed so the threat being waited on can start
+                while len(pending) < max_pending and (not pending or len(finished) < max_pending):
+                    unit = next(remaining_units, None)
+                    if unit is None:
+                        break
+                    pending.add(asyncio.ensure_future(run_unit(unit)))
+                if not pending:
+                    break
+
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    results = task.result()
+                    # Duplicates get their representative's mitigations, re-worded for their own interaction
+                    results += [
+                        (member, retarget_mitigations(mitigations, threats[position], threats[member]), failed)
+                        for position, mitigations, failed in results
+                        for member in followers.get(position, ())
+                    ]
+                    for position, mitigations, failed in results:
+                        if dedupe:
+                            # Every row gets the column, since writers take their columns from the first row
+                            threats[position]["Deduplicated From"] = representative_ids.get(position, "")
+                        if manifest is not None:
+                            # Chunks without a usable answer aren't recorded, so the next run sends them again
+                            mitigations = manifest.merge(position, mitigations, failed)
+                        row = apply_mitigations(threats[position], mitigations)
+                        threats[position] = None  # the caller owns the row from here on
+                        if ordered:
+                            finished[position] = row
+                        else:
+                            yield position, row
+                while next_position in finished:
+                    yield next_position, finished.pop(next_position)
+                    next_position += 1
+        finally:
+            # Stopped early (error, Ctrl-C or the consumer closed the stream): drop in-flight work
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+def stream_threats(threats_df, requirements, system_summary, rmp_context, req_structure_hint, **options):
+    """
+    Synchronous generator over stream_threats_async, for the CLI and Streamlit:
+    yields (position, enriched threat row) as soon as each threat is done.
+    """
+    loop = asyncio.new_event_loop()
+    stream = stream_threats_async(
+        threats_df, requirements, system_summary, rmp_context, req_structure_hint, **options
+    )
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(stream.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        # Also reached on Ctrl-C / errors mid-step: cancel whatever is still running first
+        remaining = asyncio.all_tasks(loop)
+        if remaining:
+            for task in remaining:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*remaining, return_exceptions=True))
+        loop.run_until_complete(stream.aclose())
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+
+async def process_threats_async(
+    threats_df,
+    requirements,
+    system_summary,
+    rmp_context,
+    req_structure_hint,
+    **options
+) -> pd.DataFrame:
+    """
+    Concurrent version of process_threats: collects stream_threats_async
+    into a DataFrame in the original threat order.
+    """
+    options["ordered"] = True
+    enriched_rows = [
+        row async for _, row in stream_threats_async(
+            threats_df, requirements, system_summary, rmp_context, req_structure_hint, **options
+        )
+    ]
     return pd.DataFrame(enriched_rows)
+
+def process_threats(
+    threats_df,
+    requirements,
+    system_summary,
+    rmp_context,
+    req_structure_hint,
+    **options
+) -> pd.DataFrame:
+    """
+    For each threat:
+    - Identify assets from the Interaction field
+    - Filter applicable requirements based on those assets
+    - Use LLM to suggest mitigations with justification
+
+    Options are passed through to process_threats_async:
+    - chunk_size, print_tokens, print_logs: as before
+    - asset_list: known asset names, found anywhere in each Interaction's
+      endpoints (defaults to llm_threat_mapper.DEFAULT_ASSETS); used for both
+      the asset filter and the prompt
+    - concurrency: max in-flight LLM requests (1 = one at a time)
+    - use_cache: serve/store responses in the persistent on-disk LLM cache
+    - pack_tokens: pack requirements up to the provider's token budget
+      (see llm_matcher.pack_chunks) instead of chunk_size per prompt
+    - semantic_top_k / semantic_threshold: keep only the top-k / above-threshold
+      requirements by embedding similarity, intersected with the asset filter
+    - asset_aliases: alias table for asset matching (defaults to get_asset_aliases())
+    - category_filter / category_threshold: drop requirements whose similarity to
+      the threat's STRIDE category reference is below the threshold
+    - threat_batch_size: send up to this many threats with identical candidate
+      sets in one prompt (1 = one threat per prompt)
+
+    - journal: a run_journal.RunJournal; completed chunks are recorded to it
+      and skipped when a run with the same inputs is restarted
+    - manifest: a run_manifest.RunManifest from the previous run; only new or
+      edited threats and changed requirements are sent to the LLM, the rest
+      of the mitigations are carried over (see RunManifest.plan)
+    - stream_responses: stream answers and parse them incrementally, rejecting
+      IDs outside the chunk and cutting off runaway output (defaults to
+      LLM_STREAM; single-threat prompts only, batches use regular requests)
+    - dedupe: map only one representative per cluster of duplicate threats
+      (same category and candidates, same text once the interaction's names
+      are taken out) and copy its mitigations to the others, re-worded for
+      their own interaction; a "Deduplicated From" column holds the
+      representative's Id (empty on representatives)
+    - dedupe_threshold: also cluster threats whose texts have at least this
+      embedding similarity (needs sentence-transformers; None = text only)
+    - cascade: screen candidates with a cheap model first (yes/no, see
+      llm_config.get_screen_settings) and only send the ones that pass to the
+      main model for justification; semantic_threshold is the local
+      embedding alternative to this screen
+
+    Use stream_threats to get rows as they complete instead of one DataFrame.
+    """
+    return run_async(process_threats_async(
+        threats_df,
+        requirements,
+        system_summary,
+        rmp_context,
+        req_structure_hint,
+        **options
+    ))
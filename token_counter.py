@@ -0,0 +1,84 @@
+import os
+import hashlib
+import threading
+from model_registry import get_hf_tokenizer
+
+DEFAULT_TOKENIZER = "google/flan-t5-base"
+
+# LLM_TOKENIZER value that estimates 4 characters per token without loading (or downloading) anything
+HEURISTIC_TOKENIZER = "heuristic"
+
+# Tokenizer that best approximates each provider's default model
+# ("tiktoken:<encoding>" uses the optional tiktoken package, anything else is a HF model id)
+PROVIDER_TOKENIZERS = {
+    "openai": "tiktoken:cl100k_base",
+    "mistral": "mistralai/Mistral-7B-Instruct-v0.1",
+    "groq": "mistralai/Mixtral-8x7B-v0.1",
+}
+
+def _estimate_tokens(text):
+    return range(len(text) // 4 + 1)
+
+class TokenCounter:
+    """
+    Counts tokens with a lazily loaded tokenizer and memoizes the count of
+    every text segment by its content hash, so the instruction block, the
+    threat YAML and each requirement fragment are encoded only once per run.
+    """
+
+    def __init__(self, tokenizer_name=DEFAULT_TOKENIZER):
+        self.tokenizer_name = tokenizer_name
+        self._encode = None
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def _load_encoder(self, name):
+        if name == HEURISTIC_TOKENIZER:
+            return _estimate_tokens
+        if name.startswith("tiktoken:"):
+            import tiktoken
+            return tiktoken.get_encoding(name.split(":", 1)[1]).encode
+        return get_hf_tokenizer(name).encode
+
+    def _load(self):
+        with self._lock:
+            if self._encode is not None:
+                return self._encode
+            for name in dict.fromkeys([self.tokenizer_name, DEFAULT_TOKENIZER]):
+                try:
+                    self._encode = self._load_encoder(name)
+                    self.tokenizer_name = name
+                    return self._encode
+                except Exception as e:
+                    print(f"⚠️ Couldn't load tokenizer {name} ({e})")
+            print("⚠️ No tokenizer available, estimating 4 characters per token")
+            self._encode = _estimate_tokens
+            return self._encode
+
+    def count(self, text: str) -> int:
+        """Token count of a single segment (memoized)."""
+        key = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        count = self._counts.get(key)
+        if count is None:
+            encode = self._encode or self._load()
+            count = len(encode(text))
+            self._counts[key] = count
+        return count
+
+    def count_segments(self, segments) -> int:
+        """Prompt size as the sum of its (individually memoized) segments."""
+        return sum(self.count(segment) for segment in segments)
+
+_counters = {}
+
+def get_token_counter(provider=None) -> TokenCounter:
+    """
+    Return the shared counter for a provider. The tokenizer is chosen from
+    LLM_TOKENIZER if set, otherwise from PROVIDER_TOKENIZERS.
+    """
+    provider = (provider or os.getenv("LLM_PROVIDER", "openai")).lower()
+    tokenizer_name = os.getenv("LLM_TOKENIZER") or PROVIDER_TOKENIZERS.get(provider, DEFAULT_TOKENIZER)
+    counter = _counters.get(tokenizer_name)
+    if counter is None:
+        counter = _counters.setdefault(tokenizer_name, TokenCounter(tokenizer_name))
+    return counter
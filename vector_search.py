@@ -1,28 +1,68 @@
-from sentence_transformers import SentenceTransformer, util
+import numpy as np
+from model_registry import get_embedding_model
+from embedding_store import EmbeddingStore, requirement_embedding_text
+
+def threat_embedding_text(threat: dict) -> str:
+    """Text that gets embedded for a threat (title + description + interaction)."""
+    return f"{threat['Title']} {threat['Description']} Asset: {threat.get('Interaction', '')}"
 
 class RequirementVectorSearch:
-    def __init__(self, requirements: list[dict]):
+    def __init__(self, requirements: list[dict], store: EmbeddingStore = None):
+        """
+        Requirement embeddings come from the persistent EmbeddingStore, so only
+        new or changed requirements are encoded when the catalogue is loaded.
+        """
         self.requirements = requirements
-        self.model = SentenceTransformer("all-MiniLM-L6-v2")
-        self.embeddings = self.model.encode(
-            [self._enrich_text(r) for r in requirements], convert_to_tensor=True
-        )
+        self.store = store or EmbeddingStore()
+        self.model = get_embedding_model(self.store.model_name)
+        self.embeddings = self.store.sync(requirements)
 
     def _enrich_text(self, req: dict) -> str:
-        return f"{req['text']} Asset: {req['assets']}"
+        return requirement_embedding_text(req)
 
     def get_top_k_matches(self, threat: dict, k: int = 5) -> list[str]:
         """
         For a single threat, return top k matching requirement IDs based on semantic similarity.
         """
-        threat_assets = threat.get("Interaction", "")
-        threat_text = (
-            f"{threat['Title']} {threat['Description']} Asset: {threat_assets}"
+        threat_embedding = self.model.encode(
+            threat_embedding_text(threat), convert_to_numpy=True, normalize_embeddings=True
         )
-        threat_embedding = self.model.encode(threat_text, convert_to_tensor=True)
 
-        cosine_scores = util.cos_sim(threat_embedding, self.embeddings)[0]
+        # Embeddings are normalized, so the dot product is the cosine similarity
+        cosine_scores = self.embeddings @ threat_embedding.astype(self.embeddings.dtype)
         top_k = min(k, len(self.requirements))
-        top_results = cosine_scores.topk(top_k)
+        top_indices = np.argsort(-cosine_scores, kind="stable")[:top_k]
+
+        return [self.requirements[i]["id"] for i in top_indices]
+
+    def get_candidates_batch(self, threats: list[dict], k: int = None, threshold: float = None,
+                             batch_size: int = 256) -> list[set]:
+        """
+        Semantic pre-filter for many threats at once. All threats are encoded
+        in one batch and scored against the requirement matrix with a matrix
+        multiply (in blocks of batch_size threats to bound memory).
+
+        Returns, per threat, the set of requirement IDs that are in the top k
+        and/or score at least `threshold` (whichever limits are given).
+        """
+        if not self.requirements or not threats:
+            # An empty catalogue gives a (0, 0) embedding matrix, which can't be multiplied
+            return [set() for _ in threats]
+        threat_matrix = self.model.encode(
+            [threat_embedding_text(t) for t in threats], convert_to_numpy=True, normalize_embeddings=True
+        ).astype(np.float32)
+        requirement_matrix = np.asarray(self.embeddings, dtype=np.float32)
+        ids = np.array([r["id"] for r in self.requirements], dtype=object)
 
-        return [self.requirements[i]["id"] for i in top_results.indices]
+        candidates = []
+        for start in range(0, len(threats), batch_size):
+            scores = threat_matrix[start:start + batch_size] @ requirement_matrix.T
+            for row in scores:
+                keep = np.ones(len(row), dtype=bool)
+                if k is not None and k < len(row):
+                    keep[:] = False
+                    keep[np.argpartition(-row, k)[:k]] = True
+                if threshold is not None:
+                    keep &= row >= threshold
+                candidates.append(set(ids[keep]))
+        return candidates